@@ -0,0 +1,94 @@
+import sys
+import numpy as np
+import h5py
+
+from molmod.units import picosecond, femtosecond
+
+# Start of the production phase of an MD run in traj.h5.
+#
+# For every candidate start t0 of the production phase, the statistical
+# inefficiency g of the remaining part of the volume, temperature and
+# potential energy series is computed from their autocorrelation functions,
+# and the number of uncorrelated samples is (N - t0)/g. The production phase
+# starts at the t0 with the largest number of uncorrelated samples (Chodera,
+# J. Chem. Theory Comput. 12, 1799 (2016)). The largest g of the three series
+# is used, such that every series is equilibrated and decorrelated.
+#
+# The series are read from the thermo group of traj.h5 if present (md.py
+# --production), else from the trajectory group. Frames of the trajectory
+# group (or rows of layers.h5) are then selected from the production start
+# on, with at least g frames of the series in between, by select_frames.
+#
+# Run from the scripts folder to print the result of every simulation
+#   python equilibration.py ../../MDrun/*K/*/traj.h5
+
+keys = ['volume', 'temp', 'epot']
+
+def get_autocorrelation(x):
+    # Normalized autocorrelation function of x (FFT, no periodic images)
+    n = len(x)
+    dx = x - x.mean()
+    size = 2**int(np.ceil(np.log2(2*n)))
+    fx = np.fft.rfft(dx, size)
+    acf = np.fft.irfft(fx*np.conjugate(fx), size)[:n]
+    acf /= np.arange(n, 0, -1)
+    if acf[0] <= 0:
+        return None
+    return acf/acf[0]
+
+def get_inefficiency(x, mintime = 3):
+    # Statistical inefficiency g = 1 + 2 sum_t (1 - t/N) C(t), summed up to the
+    # first non-positive C(t) after mintime
+    n = len(x)
+    acf = get_autocorrelation(np.asarray(x, float))
+    if acf is None:
+        return 1.0
+    t = np.arange(1, n)
+    stop = np.where((acf[1:] <= 0) & (t > mintime))[0]
+    end = stop[0] if len(stop) > 0 else n - 1
+    g = 1.0 + 2*np.sum((1 - t[:end]/float(n))*acf[1:end + 1])
+    return max(1.0, g)
+
+def detect_equilibration(series, ncandidate = 200, mintail = 0.1):
+    # Index of the production start and statistical inefficiency (in frames of
+    # the series) maximizing the number of uncorrelated samples of all series
+    n = min(len(x) for x in series)
+    tmax = int(n*(1 - mintail))
+    best = (0, 1.0, -1.0)
+    for t0 in np.unique(np.linspace(0, tmax, ncandidate).astype(int)):
+        g = max(get_inefficiency(x[t0:n]) for x in series)
+        neff = (n - t0)/g
+        if neff > best[2]:
+            best = (int(t0), g, neff)
+    return best
+
+def load_series(f):
+    # Time and the volume, temperature and energy series of traj.h5
+    grp = f['thermo'] if 'thermo' in f else f['trajectory']
+    return grp['time'][:], [grp[key][:] for key in keys]
+
+def detect_production(fn_h5, **kwargs):
+    # Start time of the production phase and the statistical inefficiency as
+    # a time (the decorrelation time between two samples)
+    with h5py.File(fn_h5, 'r') as f:
+        time, series = load_series(f)
+    t0, g, neff = detect_equilibration(series, **kwargs)
+    dt = time[1] - time[0]
+    return time[t0], g*dt, neff
+
+def select_frames(time, start, stride):
+    # Indices of the frames from start on, at least stride apart
+    indices = []
+    last = None
+    eps = 1e-3*femtosecond
+    for i in np.where(time >= start - eps)[0]:
+        if last is None or time[i] - last >= stride - eps:
+            indices.append(i)
+            last = time[i]
+    return np.array(indices, int)
+
+if __name__ == '__main__':
+    for fn_h5 in sys.argv[1:]:
+        start, stride, neff = detect_production(fn_h5)
+        print('{}: production from {:.1f} ps, decorrelation time {:.3f} ps, {:.0f} uncorrelated samples'.format(
+            fn_h5, start/picosecond, stride/picosecond, neff))
@@ -1,10 +1,13 @@
 import os
+import numpy as np
 import h5py
 
 from yaff.system import System, log
 log.set_level(0)
 from molmod.periodic import periodic as pt
-from molmod.units import angstrom
+from molmod.units import angstrom, femtosecond, picosecond
+
+from equilibration import detect_production, select_frames
 
 def write_frame(system, counter, path):
     folder = os.path.join(path, 'frame{}'.format(counter))
@@ -21,10 +24,16 @@ for temp in ['77K', '293K', '400K', '500K']:
         write_frame(system, 0, '../calculations/0K/' + struct)
         elements = [pt[i].symbol for i in system.numbers]
         f = h5py.File(fn_h5, 'r')
-        assert len(f['trajectory']['counter']) == 15001
-        for i in range(7500, 15001, 15):
+        # Decorrelated frames of the production phase (see equilibration.py)
+        start, stride, neff = detect_production(fn_h5)
+        time = f['trajectory']['time'][:]
+        steps = np.round(time/(0.5*femtosecond)).astype(int)
+        frames = select_frames(time, start, stride)
+        print('production from {:.1f} ps, every {:.3f} ps: {} frames'.format(
+            start/picosecond, stride/picosecond, len(frames)))
+        for i in frames:
             pos = f['trajectory']['pos'][i]
             rvecs = f['trajectory']['cell'][i]
             system.pos[:] = pos
             system.cell.update_rvecs(rvecs)
-            write_frame(system, i, '../calculations/{}/{}'.format(temp, struct))
+            write_frame(system, steps[i]//20, '../calculations/{}/{}'.format(temp, struct))
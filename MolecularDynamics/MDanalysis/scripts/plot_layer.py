@@ -13,8 +13,16 @@ from molmod.periodic import periodic as pt
 from molmod.units import angstrom, kelvin
 from molmod.constants import boltzmann
 
-def init_system(fn_h5):
+from equilibration import detect_production, select_frames
+
+def init_system(fn_h5, fn_topology = None):
     system = System.from_file(fn_h5).supercell(1,1,1)
+    if fn_topology is not None and os.path.exists(fn_topology):
+        # Layers of the topology index written by create_init.py
+        atom_layer = np.load(fn_topology)['atom_layer']
+        assert len(atom_layer) == system.natom
+        order = np.argsort(atom_layer, kind = 'stable')
+        return system, np.split(order, np.cumsum(np.bincount(atom_layer))[:-1])
     graph = MolecularGraph(system.bonds, system.numbers)
     indices = graph.independent_vertices
     z_orders = {}
@@ -64,40 +72,54 @@ if __name__ == '__main__':
         for struct in os.listdir(src):
             # Load trajectory and atom indices of every layer
             fn_h5 = os.path.join(src, struct, 'traj.h5')
-            system, sorted_indices = init_system(fn_h5)
+            fn_topology = '../../../StructureGeneration/InitialStructure/output/{}.topology.npz'.format(struct)
+            system, sorted_indices = init_system(fn_h5, fn_topology)
             
             # Calculate interlayer distance (z) and layer offset (d) for every sampled frame
             z = [] # Interlayer distance
             d = [] # Layer offset
             tfb = [] # nuber of TFB-pairs in neighboring layers
-            f = h5py.File(fn_h5, 'r')
-            for count in range(7500, 15001, 15):
-                # Get system geometry
-                pos = f['trajectory']['pos'][count]
-                rvecs = f['trajectory']['cell'][count]
-                system.pos[:] = pos
-                system.cell.update_rvecs(rvecs)
-
-                # Iterate over neighboring layers
-                for i in range(12):
-                    j = i + 1
-                    if j == 12:
-                        # Correct for the last layer
-                        sys = system.supercell(1,1,2)
-                        j -= 12
-                        indices_i = sorted_indices[i]
-                        indices_j = sorted_indices[j] + system.natom
-                    else:
-                        sys = system
-                        indices_i = sorted_indices[i]
-                        indices_j = sorted_indices[j]
-
-                    tfb_content = get_tfb_content(system, np.concatenate([sorted_indices[i], sorted_indices[j]]))
-                    x = CVCOMProjection(sys, groups = [indices_i, indices_j], index = 0).compute()
-                    y = CVCOMProjection(sys, groups = [indices_i, indices_j], index = 1).compute()
-                    z.append(CVCOMProjection(sys, groups = [indices_i, indices_j], index = 2).compute())
-                    d.append(np.sqrt(x**2 + y**2))
-                    tfb.append(tfb_content) # Number of TFB-pairs in neighboring layers (i/8, i: 0->8)
+            start, stride, neff = detect_production(fn_h5) # Production phase and decorrelation time
+            fn_layers = os.path.join(src, struct, 'layers.h5')
+            if os.path.exists(fn_layers):
+                # Computed during the MD run (mdtools/layers.py), decorrelated
+                # frames of the production phase (see equilibration.py)
+                with h5py.File(fn_layers, 'r') as f:
+                    projection = f['projection'][:][select_frames(f['time'][:], start, stride)]
+                assert projection.shape[1] == len(sorted_indices)
+                tfb_pairs = [get_tfb_content(system, np.concatenate([sorted_indices[i], sorted_indices[(i + 1) % 12]])) for i in range(12)]
+                z = list(projection[:, :, 2].ravel())
+                d = list(np.sqrt(projection[:, :, 0]**2 + projection[:, :, 1]**2).ravel())
+                tfb = list(np.tile(tfb_pairs, len(projection)))
+            else:
+                f = h5py.File(fn_h5, 'r')
+                for count in select_frames(f['trajectory']['time'][:], start, stride):
+                    # Get system geometry
+                    pos = f['trajectory']['pos'][count]
+                    rvecs = f['trajectory']['cell'][count]
+                    system.pos[:] = pos
+                    system.cell.update_rvecs(rvecs)
+
+                    # Iterate over neighboring layers
+                    for i in range(12):
+                        j = i + 1
+                        if j == 12:
+                            # Correct for the last layer
+                            sys = system.supercell(1,1,2)
+                            j -= 12
+                            indices_i = sorted_indices[i]
+                            indices_j = sorted_indices[j] + system.natom
+                        else:
+                            sys = system
+                            indices_i = sorted_indices[i]
+                            indices_j = sorted_indices[j]
+
+                        tfb_content = get_tfb_content(system, np.concatenate([sorted_indices[i], sorted_indices[j]]))
+                        x = CVCOMProjection(sys, groups = [indices_i, indices_j], index = 0).compute()
+                        y = CVCOMProjection(sys, groups = [indices_i, indices_j], index = 1).compute()
+                        z.append(CVCOMProjection(sys, groups = [indices_i, indices_j], index = 2).compute())
+                        d.append(np.sqrt(x**2 + y**2))
+                        tfb.append(tfb_content) # Number of TFB-pairs in neighboring layers (i/8, i: 0->8)
             
             z = np.array(z)
             d = np.array(d)
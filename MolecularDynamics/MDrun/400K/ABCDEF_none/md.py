@@ -1,23 +1,42 @@
+import os
+import time
+import argparse
+
 import numpy as np
 import h5py as h5
 
 from yaff import System, log
 from yaff.pes.ff import ForceField
-from yaff.external.liblammps import swap_noncovalent_lammps
+from yaff.external.liblammps import swap_noncovalent_lammps, write_lammps_table
 
-from yaff.sampling.io import HDF5Writer
 from yaff.sampling.verlet import VerletIntegrator, VerletScreenLog
 from yaff.sampling.nvt import NHCThermostat
 from yaff.sampling.npt import MTKBarostat, TBCombination
 
 from molmod.units import angstrom, femtosecond, kelvin, bar, atm, kjmol
 
+from mdtools.tabulation import TabulationCache, get_supercell_reps
+from mdtools.validation import Validation, modes
+from mdtools.npt import NPTVerletIntegrator
+from mdtools.respa import RESPAIntegrator
+from mdtools.trajectory import get_writer, layouts, PolicyHDF5Writer, ThermoWriter
+from mdtools.restart import get_chain_state, get_chain_kwargs, read_restart, read_warm_start, set_chain_state
+from mdtools.walltime import WalltimeBudget, parse_walltime, resubmit_status
+from mdtools.layers import LayerHook
+from mdtools.telemetry import TelemetryHook
+
+# MPI is selected at launch time with the --mpi flag (see setup_mpi)
 mpi = False
-if mpi:
+rank = 0
+nprocs = 1
+
+def setup_mpi(subcomm = None):
+    global mpi, comm, rank, nprocs
     from mpi4py import MPI
 
-    # Setup MPI
-    comm = MPI.COMM_WORLD
+    # Setup MPI, on all ranks or on a subcommunicator (e.g. one replica)
+    mpi = True
+    comm = MPI.COMM_WORLD if subcomm is None else subcomm
     rank = comm.Get_rank()
     nprocs = comm.Get_size()
 
@@ -25,6 +44,16 @@ if mpi:
     log.set_level(log.silent)
     if rank==0: log.set_level(log.medium)
 
+    # Every rank integrates the same trajectory (only LAMMPS is distributed),
+    # so all ranks have to draw the same initial velocities
+    seed = np.random.randint(2**31) if rank == 0 else None
+    np.random.seed(comm.bcast(seed, root = 0))
+
+def report(line):
+    # Print only on the first rank
+    if rank == 0:
+        print(line)
+
 def get_ff_kwargs():
     ff_kwargs = {
             'rcut': 15*angstrom,
@@ -35,56 +64,365 @@ def get_ff_kwargs():
     }
     return ff_kwargs
 
-def load_ff(sys, fn_pars, use_lammps = True):
+def tabulate_supercell(sys, fn_pars, ff_kwargs, reps, fn_table):
+    # Tabulate the non-bonded interactions on a supercell of sys, which is
+    # required when the cell is too narrow compared to the cutoff. Only the
+    # table is written, no LAMMPS instance is set up for the supercell.
+    # Returns the time to generate the force field and to write the table.
+    t_generate, t_table = 0.0, 0.0
+    if rank == 0:
+        t0 = time.time()
+        sys_large = sys.supercell(*reps)
+        ff_large = ForceField.generate(sys_large, fn_pars, **ff_kwargs)
+        t_generate = time.time() - t0
+        t0 = time.time()
+        write_lammps_table(ff_large, fn = fn_table, nrows = 5000)
+        t_table = time.time() - t0
+    if mpi:
+        comm.Barrier()
+    return t_generate, t_table
+
+def swap_lammps(ff, fn_sys, fn_table):
+    if mpi:
+        return swap_noncovalent_lammps(ff, fn_system = fn_sys,
+                fn_table = fn_table, comm = comm)
+    else:
+        return swap_noncovalent_lammps(ff, fn_system = fn_sys,
+                fn_table = fn_table)
+
+def load_ff(sys, fn_pars, use_lammps = True, cache = None, validation = None):
     ff_kwargs = get_ff_kwargs()
+    t0 = time.time()
     ff = ForceField.generate(sys, fn_pars, **ff_kwargs)
+    t_generate = time.time() - t0
     if use_lammps:
         fn_sys = 'system.dat' # LAMMPS System file
         fn_table = 'table.dat' # LAMMPS force field tabulation file
+        # Reuse the tabulation of an earlier run with identical parameters
+        t0 = time.time()
+        hit, key = False, None
+        if cache is not None:
+            key = cache.get_key(sys, fn_pars, ff_kwargs)
+            if rank == 0:
+                hit = cache.fetch(key, fn_table)
+        need_table = not os.path.isfile(fn_table)
+        if mpi:
+            hit, need_table = comm.bcast((hit, need_table), root = 0)
+        # Decide up front whether the interactions have to be tabulated on a
+        # supercell, by comparing the perpendicular widths of the cell with rcut
+        reps = get_supercell_reps(sys, ff_kwargs['rcut'])
+        report('STARTUP cell widths = {} A rcut = {:.1f} A -> tabulation on {} cell'.format(
+            ' '.join('{:.1f}'.format(w/angstrom) for w in sys.cell.rspacings),
+            ff_kwargs['rcut']/angstrom, 'x'.join(str(r) for r in reps)))
+        t_super = None
+        if need_table and not reps == (1, 1, 1):
+            t_super = tabulate_supercell(sys, fn_pars, ff_kwargs, reps, fn_table)
+        planned = t_super is not None
         # Tabulate the non-bonded interactions
         # Bonded interactions remain calculated by Yaff
         try:
-            if mpi:
-                ff_lammps = swap_noncovalent_lammps(ff, fn_system = fn_sys,
-                        fn_table = fn_table, comm = comm)
-            else:
-                ff_lammps = swap_noncovalent_lammps(ff, fn_system = fn_sys,
-                        fn_table = fn_table)
+            t1 = time.time()
+            ff_lammps = swap_lammps(ff, fn_sys, fn_table)
         except ValueError:
-            sys_large = sys.supercell(2,2,2)
-            ff_large = ForceField.generate(sys_large, fn_pars, **ff_kwargs)
-            if mpi:
-                ff_large_lammps = swap_noncovalent_lammps(ff_large,
-                        fn_system = 'system_large.dat', fn_table = fn_table, comm = comm)
-            else:
-                ff_large_lammps = swap_noncovalent_lammps(ff_large,
-                        fn_system = 'system_large.dat', fn_table = fn_table)
-            ff_lammps = swap_noncovalent_lammps(ff, fn_system = fn_sys, fn_table = fn_table)
-        gpos, vtens = np.zeros((sys.natom, 3)), np.zeros((3, 3))
-        gpos_lammps, vtens_lammps = np.zeros((sys.natom, 3)), np.zeros((3, 3))
-        e = ff.compute(gpos, vtens)
-        e_lammps = ff_lammps.compute(gpos_lammps, vtens_lammps)
-        p = np.trace(vtens)/3.0/ff.system.cell.volume
-        p_lammps = np.trace(vtens_lammps)/3.0/ff.system.cell.volume
-        print("E(Yaff) = %12.3f E(LAMMPS) = %12.3f deltaE = %12.3e kJ/mol"%(e/kjmol,e_lammps/kjmol,(e_lammps-e)/kjmol))
-        print("P(Yaff) = %12.3f P(LAMMPS) = %12.3f deltaP = %12.3e bar"%(p/bar,p_lammps/bar,(p_lammps-p)/bar))
+            # Not predicted by the geometry check, fall back to a 2x2x2 supercell
+            report('STARTUP tabulation failed on {} cell after {:.1f} s, retrying on 2x2x2 supercell'.format(
+                'x'.join(str(r) for r in reps), time.time() - t0))
+            reps = (2, 2, 2)
+            t_super = tabulate_supercell(sys, fn_pars, ff_kwargs, reps, fn_table)
+            t1 = time.time()
+            ff_lammps = swap_lammps(ff, fn_sys, fn_table)
+        t_setup = time.time() - t1
+        t_lammps = time.time() - t0
+        report('STARTUP generate = {:.1f} s tabulate + LAMMPS setup = {:.1f} s'.format(t_generate, t_lammps))
+        if t_super is not None:
+            nrep = int(np.prod(reps))
+            report('STARTUP supercell {} generate = {:.1f} s table = {:.1f} s LAMMPS setup (unit cell) = {:.1f} s'.format(
+                'x'.join(str(r) for r in reps), t_super[0], t_super[1], t_setup))
+        if planned:
+            # Without the geometry check, the unit cell is tabulated first,
+            # which fails, and the supercell is tabulated while LAMMPS is set
+            # up for it. The failed tabulation is estimated by the table time
+            # of the supercell (at most), the LAMMPS setup of the supercell by
+            # nrep times the one of the unit cell.
+            report('STARTUP avoided ~{:.1f} s: failed tabulation on the unit cell ~{:.1f} s + '
+                   'LAMMPS setup of the supercell ~{:.1f} s'.format(
+                    t_super[1] + nrep*t_setup, t_super[1], nrep*t_setup))
+        if cache is not None and rank == 0:
+            cache.record(key, hit, t_lammps, fn_table,
+                    info = {'pars': os.path.abspath(fn_pars), 'ff_kwargs': ff_kwargs})
+        # Compare with the Yaff reference (Ewald summation) if requested
+        if validation is not None:
+            validation.startup(ff, ff_lammps, cache = cache, key = key)
         return ff_lammps
     else:
         return ff
 
-def load_integrator(ff, temp = 300.0*kelvin, press = 1*atm):
-    vsl = VerletScreenLog(step = 20) # Print information to screen every 10 steps
-    hdf5_writer = HDF5Writer(h5.File('traj.h5', mode='w'), step = 20) # HDF5 file with trajectory data
-    thermo = NHCThermostat(temp, timecon=100*femtosecond) # Thermostat with timeconstant of 100fs
-    baro = MTKBarostat(ff, temp = temp, press = press, timecon=1000*femtosecond) # Barostat
-    tbc = TBCombination(thermo, baro) # Combine thermostat and barostat
-    verlet = VerletIntegrator(ff, 0.5*femtosecond, temp0 = temp, hooks=[vsl, hdf5_writer, tbc]) # Verlet integrator
+def get_frame_step(respa = 1):
+    # Steps between two frames (10 fs). With RESPA, every step of the
+    # integrator covers respa steps of 0.5 fs, so respa has to divide 20
+    if respa < 1 or 20 % respa != 0:
+        raise ValueError('respa = {} does not divide the 20 steps of 0.5 fs of a frame'.format(respa))
+    return 20//respa
+
+def load_integrator(ff, temp = 300.0*kelvin, press = 1*atm, validation = None, npt = 'mtk', respa = 1, traj = 'yaff',
+        restart = None, layer_step = 0, telemetry_step = 0, production = None, production_step = 300,
+        checkpoint_step = 1000, warm = None):
+    if npt not in ['mtk', 'virial']:
+        raise ValueError('Unknown NPT mode {}'.format(npt))
+    if respa > 1 and npt != 'virial':
+        raise ValueError('RESPA (respa = {}) is only available with npt = virial'.format(respa))
+    step = get_frame_step(respa)
+    # All steps below count steps of 0.5 fs and become steps of respa*0.5 fs
+    for label, value in [('production', production), ('production_step', production_step),
+            ('checkpoint_step', checkpoint_step), ('layer_step', layer_step)]:
+        if value is not None and value % respa != 0:
+            raise ValueError('{} = {} is not a multiple of respa = {}'.format(label, value, respa))
+    vsl = VerletScreenLog(step = step) # Print information to screen every 10 fs
+    hooks = [vsl]
+    kwargs = {}
+    if restart is not None:
+        # Continue from the last frame of traj.h5, which is not written again
+        ff.update_rvecs(restart['cell'])
+        ff.update_pos(restart['pos'])
+        kwargs = {'vel0': restart['vel'], 'time0': restart['time'], 'counter0': restart['counter']}
+    elif warm is not None:
+        # New run from the end of a run at another temperature
+        ff.update_rvecs(warm['cell'])
+        ff.update_pos(warm['pos'])
+        kwargs = {'vel0': warm['vel']}
+    if rank == 0:
+        f = h5.File('traj.h5', mode = 'w' if restart is None else 'a')
+        if production is None:
+            if restart is None:
+                hdf5_writer = get_writer(f, layout = traj, step = step) # HDF5 file with trajectory data
+            else:
+                hdf5_writer = get_writer(f, layout = traj, start = restart['counter'] + step, step = step)
+            hooks.append(hdf5_writer)
+            frame_writer = hdf5_writer
+        else:
+            # Cell and energies every 10 fs, full frames every production_step
+            # steps in the production phase and every checkpoint_step steps
+            # (restart frames) during the equilibration. Steps of 0.5 fs.
+            after = -1 if restart is None else restart['counter']
+            frame_writer = PolicyHDF5Writer(f, production//respa, max(1, production_step//respa),
+                    max(1, checkpoint_step//respa), after = after, layout = traj)
+            hooks.append(frame_writer)
+            hooks.append(ThermoWriter(f, start = 0 if restart is None else restart['counter'], step = step,
+                    layout = traj))
+        if layer_step > 0:
+            # Interlayer distance and layer offset of every pair of neighbouring
+            # layers, every layer_step steps of 0.5 fs. Written to disk with
+            # every full frame of traj.h5, so a restart finds no gap.
+            mode = 'a' if restart is not None and os.path.isfile('layers.h5') else 'w'
+            start = 0 if restart is None else restart['counter']
+            hooks.append(LayerHook('layers.h5', ff.system, start = start, step = max(1, layer_step//respa),
+                    mode = mode, sync = frame_writer))
+        if telemetry_step > 0:
+            # Timings per part, steps/s and memory use in telemetry.jsonl
+            hooks.append(TelemetryHook('telemetry.jsonl', step = telemetry_step, timestep = respa*0.5*femtosecond))
+    if validation is not None and validation.get_hook() is not None:
+        hooks.append(validation.get_hook()) # Yaff vs LAMMPS drift monitor
+    # On a restart, the hooks neither clean the momenta nor symmetrize the
+    # cell, and continue the thermostat chain and the barostat of traj.h5
+    is_restart = restart is not None
+    chain = {}
+    if is_restart:
+        chain = get_chain_kwargs(restart)
+        if not chain:
+            report('RESTART no thermostat/barostat state in traj.h5, the chain starts from scratch')
+    thermo, baro = None, None
+    if npt == 'mtk':
+        thermo = NHCThermostat(temp, timecon=100*femtosecond, chain_pos0 = chain.get('chain_pos'),
+                chain_vel0 = chain.get('chain_vel'), restart = is_restart) # Thermostat with timeconstant of 100fs
+        baro = MTKBarostat(ff, temp = temp, press = press, timecon=1000*femtosecond,
+                vel_press0 = chain.get('vel_press'), restart = is_restart) # Barostat
+    # Thermostat and barostat state in traj.h5, unless appending to a trajectory without it
+    state = None
+    if not is_restart or chain:
+        state = get_chain_state(npt, thermo = thermo, baro = baro)
+    if npt == 'mtk':
+        tbc = TBCombination(thermo, baro) # Combine thermostat and barostat
+        verlet = VerletIntegrator(ff, 0.5*femtosecond, temp0 = temp, hooks=hooks + [tbc], state = state, **kwargs) # Verlet integrator
+    elif npt == 'virial' and respa > 1:
+        # Valence part every 0.5 fs, LAMMPS part every respa*0.5 fs
+        verlet = RESPAIntegrator(ff, respa*0.5*femtosecond, temp, press, nrespa = respa,
+                timecon_thermo=100*femtosecond, timecon_baro=1000*femtosecond, temp0 = temp, hooks=hooks,
+                state = state, restart = is_restart, **kwargs)
+    else:
+        # Same ensemble, but the barostat uses the virial of the force call of the step
+        verlet = NPTVerletIntegrator(ff, 0.5*femtosecond, temp, press, timecon_thermo=100*femtosecond,
+                timecon_baro=1000*femtosecond, temp0 = temp, hooks=hooks, state = state,
+                restart = is_restart, **kwargs)
+    if npt == 'virial' and chain:
+        set_chain_state(verlet, chain)
     return verlet
 
+def get_chunk(counter, nmin, respa = 1, production = None, production_step = 300, checkpoint_step = 1000):
+    # Steps from counter to the first full (restart) frame of traj.h5 that is
+    # at least nmin steps later, see load_integrator
+    target = counter + nmin
+    if production is None:
+        stride = get_frame_step(respa)
+        return -(-target//stride)*stride - counter
+    production = production//respa
+    production_step = max(1, production_step//respa)
+    checkpoint_step = max(1, checkpoint_step//respa)
+    if target < production:
+        stop = min(-(-target//checkpoint_step)*checkpoint_step, production)
+    else:
+        stop = production + -(-(target - production)//production_step)*production_step
+    return stop - counter
+
+def run_walltime(verlet, nsteps, budget, chunk):
+    # Run in chunks that end on a full frame, chunk(counter) steps from
+    # counter, as long as the next chunk fits in the walltime budget. Returns
+    # the number of steps done.
+    nrun = 0
+    while nrun < nsteps:
+        n = min(chunk(verlet.counter), nsteps - nrun)
+        fits = budget.fits(n)
+        if mpi:
+            fits = comm.bcast(fits, root = 0)
+        if not fits:
+            break
+        t0 = time.time()
+        verlet.run(n)
+        budget.update(n, time.time() - t0)
+        nrun += n
+    return nrun
+
 if __name__ == '__main__':
+    t_start = time.time()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache', default = '../../tables',
+            help = 'folder with cached LAMMPS tabulations (shared by all runs)')
+    parser.add_argument('--no-cache', action = 'store_true',
+            help = 'always tabulate the non-bonded interactions from scratch')
+    parser.add_argument('--validate', default = 'once', choices = modes,
+            help = 'compare LAMMPS with the Yaff reference never, once per tabulation or every N steps')
+    parser.add_argument('--validate-step', type = int, default = 1000,
+            help = 'N for --validate every')
+    parser.add_argument('--mpi', action = 'store_true',
+            help = 'distribute LAMMPS over all ranks of MPI.COMM_WORLD (launch with mpirun)')
+    parser.add_argument('--no-lammps', action = 'store_true',
+            help = 'Yaff force field (Ewald summation) for all parts, e.g. for tests where LAMMPS is not available')
+    parser.add_argument('--steps', type = int, default = 300000,
+            help = 'number of MD steps')
+    parser.add_argument('--npt', default = 'mtk', choices = ['mtk', 'virial'],
+            help = 'TBCombination(NHCThermostat, MTKBarostat) or the single force call NPT integrator')
+    parser.add_argument('--respa', type = int, default = 1,
+            help = 'evaluate the non-covalent (LAMMPS) part only every N steps of 0.5 fs, N dividing 20 '
+                   '(requires --npt virial)')
+    parser.add_argument('--traj', default = 'yaff', choices = sorted(layouts),
+            help = 'storage layout of traj.h5 (see mdtools/trajectory.py)')
+    parser.add_argument('--restart', action = 'store_true',
+            help = 'continue from the last frame of traj.h5 if it exists (same options as the first run)')
+    parser.add_argument('--layer-step', type = int, default = 20,
+            help = 'write the layer COM separations to layers.h5 every N steps of 0.5 fs (0 = off), '
+                   'by default every frame of traj.h5 (10 fs)')
+    parser.add_argument('--telemetry-step', type = int, default = 1000,
+            help = 'append timings and memory use to telemetry.jsonl every N steps (0 = off)')
+    parser.add_argument('--production', type = int, default = None,
+            help = 'first step of the production phase; before it, traj.h5 only keeps the cell and energies '
+                   '(thermo group) and restart frames (default: full frames every 10 fs for the whole run)')
+    parser.add_argument('--production-step', type = int, default = 300,
+            help = 'steps between two full frames in the production phase')
+    parser.add_argument('--checkpoint-step', type = int, default = 1000,
+            help = 'steps between two full (restart) frames before the production phase, '
+                   'md.py --restart redoes the steps after the last full frame')
+    parser.add_argument('--warm-start', default = None,
+            help = 'start from the last frame of the traj.h5 of another temperature, with rescaled velocities')
+    parser.add_argument('--warm-equilibration', type = int, default = 20000,
+            help = 'equilibration steps after a warm start, instead of --production (or 150000 without it)')
+    parser.add_argument('--walltime', default = None,
+            help = 'walltime of the job ([[hh:]mm:]ss), stop in time with exit status {}'.format(resubmit_status))
+    parser.add_argument('--walltime-margin', type = float, default = 1200.0,
+            help = 'seconds kept free at the end of the walltime (copying back traj.h5)')
+    args = parser.parse_args()
+    if args.respa < 1 or 20 % args.respa != 0:
+        parser.error('--respa should divide 20, the steps of 0.5 fs between two frames (10 fs)')
+    for option in ['production', 'production_step', 'checkpoint_step', 'layer_step', 'warm_equilibration']:
+        value = getattr(args, option)
+        if value is not None and value % args.respa != 0:
+            parser.error('--{} should be a multiple of --respa'.format(option.replace('_', '-')))
+    if args.respa > 1 and args.npt != 'virial':
+        parser.error('--respa is only available with --npt virial')
+    if args.mpi:
+        setup_mpi()
+    cache = None if args.no_cache else TabulationCache(args.cache)
+    validation = None
+    if not args.no_lammps:
+        validation = Validation(args.validate, step = args.validate_step, fn_out = 'validation.jsonl',
+                do_write = rank == 0)
+
+    restart = None
+    if args.restart and os.path.isfile('traj.h5'):
+        if rank == 0:
+            restart = read_restart('traj.h5')
+        if mpi:
+            restart = comm.bcast(restart, root = 0)
+
+    # A warm start shortens the equilibration, and the run, by saved steps
+    temp = 400.0*kelvin
+    warm, saved = None, 0
+    production = args.production
+    if args.warm_start is not None:
+        equilibration = 150000 if args.production is None else args.production
+        saved = max(equilibration - args.warm_equilibration, 0)
+        if args.production is not None:
+            production = args.production - saved
+        if restart is None:
+            if rank == 0:
+                warm = read_warm_start(args.warm_start, temp)
+            if mpi:
+                warm = comm.bcast(warm, root = 0)
+            if warm is None:
+                raise SystemExit('WARMSTART no complete frame in {}'.format(args.warm_start))
+            report('WARMSTART from {} at {:.1f} ps, T = {:.1f} K, velocities scaled by {:.4f}'.format(
+                args.warm_start, warm['time_src']/(1000*femtosecond), warm['temp_src']/kelvin, warm['scale']))
+        report('WARMSTART equilibration = {} steps instead of {}, saved = {} steps'.format(
+            args.warm_equilibration, equilibration, saved))
+
     sys = System.from_file('init.chk')
-    ff = load_ff(sys, 'pars.txt')
-    verlet = load_integrator(ff, temp = 400.0*kelvin)
-    verlet.run(300000)
+    ff = load_ff(sys, 'pars.txt', use_lammps = not args.no_lammps, cache = cache, validation = validation)
+    verlet = load_integrator(ff, temp = temp, validation = validation, npt = args.npt, respa = args.respa,
+            traj = args.traj, restart = restart, layer_step = args.layer_step,
+            telemetry_step = args.telemetry_step, production = production,
+            production_step = args.production_step, checkpoint_step = args.checkpoint_step, warm = warm)
+    # --steps counts steps of 0.5 fs in total, also with RESPA and restarts
+    done = 0
+    if restart is not None:
+        done = int(round(restart['time']/(0.5*femtosecond)))
+        report('RESTART frames = {} counter = {} done = {} of {} steps'.format(
+            restart['nframe'], restart['counter'], done, args.steps))
+    nsteps = max(args.steps - saved - done, 0)//args.respa
+    t0 = time.time()
+    if args.walltime is None:
+        verlet.run(nsteps)
+        nrun = nsteps
+    else:
+        budget = WalltimeBudget(parse_walltime(args.walltime), margin = args.walltime_margin, t0 = t_start)
+        # Chunks of at least 50 frames (500 fs), ending on a full frame, so a
+        # resubmission redoes no steps
+        chunk = lambda counter: get_chunk(counter, 50*get_frame_step(args.respa), respa = args.respa,
+                production = production, production_step = args.production_step,
+                checkpoint_step = args.checkpoint_step)
+        nrun = run_walltime(verlet, nsteps, budget, chunk)
+    for hook in verlet.hooks:
+        if isinstance(hook, LayerHook):
+            hook.flush()
+    walltime = time.time() - t0
+    report('PERF nprocs = {} steps = {} walltime = {:.1f} s ns/day = {:.4f}'.format(
+        nprocs, nrun, walltime, nrun*verlet.timestep/(1e6*femtosecond)/(walltime/86400)))
+    if nrun < nsteps:
+        # traj.h5 ends on a complete frame, md.py --restart continues from there
+        report('WALLTIME stopped after {} of {} steps, {:.3f} s/step, {:.0f} s left'.format(
+            nrun, nsteps, budget.time_per_step or 0.0, budget.remaining()))
+        for hook in verlet.hooks:
+            if hasattr(hook, 'f'):
+                hook.f.flush()
+        if nrun == 0:
+            raise SystemExit('WALLTIME budget too small for a single chunk of steps')
+        raise SystemExit(resubmit_status)
 
 
@@ -11,33 +11,62 @@ date
 ORIGDIR=$PBS_O_WORKDIR
 WORKDIR=/local/$PBS_JOBID
 
+# Number of MPI ranks is chosen at submission time, e.g. qsub -l nodes=1:ppn=16 md.sh
+NPROCS=$(cat $PBS_NODEFILE | wc -l)
+NNODES=$(sort -u $PBS_NODEFILE | wc -l)
+# Local scratch is only visible on one node, so multi-node runs use a shared folder
+if [ $NNODES -gt 1 ]; then WORKDIR=${ORIGDIR}/work_$PBS_JOBID; fi
+
 if [ ! -d $WORKDIR ]; then mkdir -p $WORKDIR; fi
 cd $WORKDIR
 
 cp ${ORIGDIR}/md.py $WORKDIR
 cp ${ORIGDIR}/pars.txt $WORKDIR
 cp ${ORIGDIR}/init.chk $WORKDIR
+cp -r ${ORIGDIR}/../../mdtools $WORKDIR
+# Continue a run that was interrupted by the walltime (resubmit md.sh)
+if [ -f ${ORIGDIR}/traj.h5 ]; then cp ${ORIGDIR}/traj.h5 $WORKDIR; fi
+if [ -f ${ORIGDIR}/md.log ]; then cp ${ORIGDIR}/md.log $WORKDIR; fi
+if [ -f ${ORIGDIR}/layers.h5 ]; then cp ${ORIGDIR}/layers.h5 $WORKDIR; fi
+if [ -f ${ORIGDIR}/telemetry.jsonl ]; then cp ${ORIGDIR}/telemetry.jsonl $WORKDIR; fi
 
 # Copy back results every half hour
 ( while true; do
         sleep 1800
         cp ${WORKDIR}/traj.h5 ${ORIGDIR}
         cp ${WORKDIR}/md.log ${ORIGDIR}
+        if [ -f ${WORKDIR}/layers.h5 ]; then cp ${WORKDIR}/layers.h5 ${ORIGDIR}; fi
+        if [ -f ${WORKDIR}/telemetry.jsonl ]; then cp ${WORKDIR}/telemetry.jsonl ${ORIGDIR}; fi
+        if [ -f ${WORKDIR}/validation.jsonl ]; then cp ${WORKDIR}/validation.jsonl ${ORIGDIR}; fi
   done ) &
 
 
 # Load modules
 module load LAMMPS/3Mar2020-foss-2019b-Python-3.7.4-kokkos # Load LAMMPS, also loads yaff
 
-# Run
-python md.py > md.log
+# Run, stopping in time before the walltime of the #PBS line above
+if [ $NPROCS -gt 1 ]; then
+    mpirun -np $NPROCS python md.py --mpi --restart --production 150000 --walltime 72:00:00 --cache ${ORIGDIR}/../../tables >> md.log # LAMMPS distributed over all ranks
+else
+    python md.py --restart --production 150000 --walltime 72:00:00 --cache ${ORIGDIR}/../../tables >> md.log # Tabulations are shared by all temperatures
+fi
+STATUS=$?
 
 # Copy back results
 cp ${WORKDIR}/traj.h5 ${ORIGDIR}
 cp ${WORKDIR}/md.log ${ORIGDIR}
+if [ -f ${WORKDIR}/layers.h5 ]; then cp ${WORKDIR}/layers.h5 ${ORIGDIR}; fi
+if [ -f ${WORKDIR}/telemetry.jsonl ]; then cp ${WORKDIR}/telemetry.jsonl ${ORIGDIR}; fi
+if [ -f ${WORKDIR}/validation.jsonl ]; then cp ${WORKDIR}/validation.jsonl ${ORIGDIR}; fi
 
 # Finalize
 rm -rf $WORKDIR
 
+# Not finished within the walltime, continue in a new job
+if [ $STATUS -eq 99 ]; then
+    cd $ORIGDIR
+    qsub -l nodes=${NNODES}:ppn=$((NPROCS/NNODES)) md.sh
+fi
+
 date
 
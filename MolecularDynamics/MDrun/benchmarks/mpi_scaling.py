@@ -0,0 +1,69 @@
+import os
+import re
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+# Strong scaling of md.py with the number of MPI ranks. For every structure,
+# a short MD run is done with each rank count and the ns/day reported by
+# md.py (PERF line, MD loop only) is collected. The recommended rank count is
+# the largest one that still has a parallel efficiency above --efficiency.
+#
+# Run from the MDrun folder inside an allocation with enough cores, e.g.
+#   qsub -l nodes=1:ppn=36 benchmarks/mpi_scaling.sh
+
+def run(src, nprocs, steps, cache, options = None, keep = False):
+    # Short md.py run in a temporary folder, returns ns/day of the MD loop
+    # (and the folder with traj.h5 if keep is True)
+    workdir = tempfile.mkdtemp(prefix = 'md_benchmark_')
+    for fn in ['md.py', 'pars.txt', 'init.chk']:
+        shutil.copy(os.path.join(src, fn), workdir)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.getcwd(), env.get('PYTHONPATH', '')])
+    command = ['python', 'md.py', '--steps', str(steps), '--validate', 'off', '--cache', cache]
+    if options is not None:
+        command += options
+    if nprocs > 1:
+        command = ['mpirun', '-np', str(nprocs)] + command + ['--mpi']
+    output = subprocess.check_output(command, cwd = workdir, env = env).decode()
+    match = re.search(r'PERF .* ns/day = ([0-9.eE+-]+)', output)
+    if match is None:
+        raise RuntimeError('No PERF line in the output of {}'.format(' '.join(command)))
+    if keep:
+        return float(match.group(1)), workdir
+    shutil.rmtree(workdir)
+    return float(match.group(1))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--temp', default = '293K')
+    parser.add_argument('--structs', nargs = '+', default = None)
+    parser.add_argument('--ranks', nargs = '+', type = int, default = [1, 2, 4, 8, 16, 32])
+    parser.add_argument('--steps', type = int, default = 200)
+    parser.add_argument('--efficiency', type = float, default = 0.75)
+    parser.add_argument('--out', default = 'benchmarks/mpi_scaling.dat')
+    args = parser.parse_args()
+
+    structs = args.structs
+    if structs is None:
+        structs = sorted(os.listdir(args.temp))
+    cache = os.path.abspath('tables')
+    with open(args.out, 'w') as f:
+        f.write('# struct nprocs ns/day speedup efficiency\n')
+        for struct in structs:
+            src = os.path.join(args.temp, struct)
+            # Tabulate once before timing, such that all runs hit the cache
+            run(src, 1, 1, cache)
+            speeds = {}
+            for nprocs in args.ranks:
+                speeds[nprocs] = run(src, nprocs, args.steps, cache)
+                speedup = speeds[nprocs]/speeds[args.ranks[0]]
+                efficiency = speedup*args.ranks[0]/nprocs
+                line = '{} {} {:.4f} {:.2f} {:.2f}'.format(struct, nprocs, speeds[nprocs], speedup, efficiency)
+                print(line)
+                f.write(line + '\n')
+                f.flush()
+            best = max(n for n in args.ranks
+                    if speeds[n]/speeds[args.ranks[0]]*args.ranks[0]/n >= args.efficiency or n == args.ranks[0])
+            print('{}: use {} ranks ({:.3f} ns/day)'.format(struct, best, speeds[best]))
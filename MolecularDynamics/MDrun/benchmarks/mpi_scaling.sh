@@ -0,0 +1,19 @@
+#!/bin/sh
+#
+#PBS -N _md_mpi_scaling
+#PBS -l walltime=12:00:00
+#PBS -l nodes=1:ppn=36
+#PBS -m n
+
+date
+
+# Run from the MDrun folder
+cd $PBS_O_WORKDIR
+
+# Load modules
+module load LAMMPS/3Mar2020-foss-2019b-Python-3.7.4-kokkos # Load LAMMPS, also loads yaff
+
+# Run
+python benchmarks/mpi_scaling.py --ranks 1 2 4 9 18 36 > benchmarks/mpi_scaling.log
+
+date
@@ -0,0 +1,78 @@
+import os
+import sys
+import shutil
+import argparse
+
+import numpy as np
+import h5py as h5
+
+from molmod.units import angstrom, bar, femtosecond
+
+from mpi_scaling import run
+
+# Compare the two NPT modes of md.py: TBCombination(NHCThermostat,
+# MTKBarostat) ('mtk') and the integrator that takes the virial from the
+# force call of the Verlet step ('virial'), optionally also with multiple time
+# stepping ('respaN', LAMMPS part every N steps). For every structure, the time
+# per 0.5 fs and the averages of the volume, temperature and pressure are reported.
+# The averages carry a block-averaged standard error; both modes sample the
+# same ensemble if the differences are within a few standard errors.
+#
+# Run from the MDrun folder, e.g.
+#   python benchmarks/npt_modes.py --structs ABCDEF_all ABCDEF_none --steps 20000
+# With --no-lammps, md.py uses the Yaff force field (Ewald summation) for all
+# parts, which gives the relative cost of the modes where LAMMPS is not
+# available.
+
+def block_average(data, nblock = 10):
+    # Mean and standard error from nblock independent blocks
+    blocks = np.array([block.mean() for block in np.array_split(data, nblock)])
+    return blocks.mean(), blocks.std(ddof = 1)/np.sqrt(nblock)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--temp', default = '293K')
+    parser.add_argument('--structs', nargs = '+', default = ['ABCDEF_all', 'ABCDEF_none'])
+    parser.add_argument('--steps', type = int, default = 20000)
+    parser.add_argument('--equi', type = float, default = 0.25,
+            help = 'fraction of the frames discarded as equilibration')
+    parser.add_argument('--respa', nargs = '*', type = int, default = [2, 4],
+            help = 'also run --npt virial --respa N for these N')
+    parser.add_argument('--no-lammps', action = 'store_true',
+            help = 'run md.py --no-lammps')
+    parser.add_argument('--out', default = 'benchmarks/npt_modes.dat')
+    args = parser.parse_args()
+
+    cache = os.path.abspath('tables')
+    modes = [('mtk', ['--npt', 'mtk']), ('virial', ['--npt', 'virial'])]
+    modes += [('respa{}'.format(n), ['--npt', 'virial', '--respa', str(n)]) for n in args.respa]
+    if args.no_lammps:
+        modes = [(mode, options + ['--no-lammps']) for mode, options in modes]
+    quantities = [('volume', angstrom**3, 'A^3'), ('temp', 1.0, 'K'), ('press', bar, 'bar')]
+    with open(args.out, 'w') as f:
+        f.write('# python ' + ' '.join(sys.argv) + '\n')
+        f.write('# struct mode ms/step ' + ' '.join('{0} err_{0}'.format(q) for q, _, _ in quantities) + '\n')
+        for struct in args.structs:
+            src = os.path.join(args.temp, struct)
+            results = {}
+            for mode, options in modes:
+                nsday, workdir = run(src, 1, args.steps, cache, options = options, keep = True)
+                # ns/day -> wall time per 0.5 fs of simulated time
+                ms_step = 86400e3/(nsday*1e6/0.5)
+                with h5.File(os.path.join(workdir, 'traj.h5'), 'r') as traj:
+                    start = int(args.equi*len(traj['trajectory/counter']))
+                    averages = [block_average(traj['trajectory/{}'.format(q)][start:]/unit) for q, unit, _ in quantities]
+                shutil.rmtree(workdir)
+                results[mode] = (ms_step, averages)
+                line = '{} {} {:.2f} '.format(struct, mode, ms_step) + ' '.join('{:.4g} {:.2g}'.format(*a) for a in averages)
+                print(line)
+                f.write(line + '\n')
+                f.flush()
+            # Saving per step and ensemble consistency
+            ms_mtk, av_mtk = results['mtk']
+            for mode, _ in modes[1:]:
+                ms_mode, av_mode = results[mode]
+                print('{} {}: {:.2f} ms/step saved ({:.1f}%)'.format(struct, mode, ms_mtk - ms_mode, 100*(ms_mtk - ms_mode)/ms_mtk))
+                for (q, _, label), (m0, e0), (m1, e1) in zip(quantities, av_mtk, av_mode):
+                    print('    {:6s} mtk = {:.4g} {} = {:.4g} {} ({:.1f} sigma)'.format(
+                        q, m0, mode, m1, label, abs(m1 - m0)/np.sqrt(e0**2 + e1**2)))
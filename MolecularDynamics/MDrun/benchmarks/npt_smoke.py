@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from molmod.units import kelvin, femtosecond
+
+from remd import load_md
+
+# Smoke test of the NPT modes of md.py. A short run of every mode is done
+# with the Yaff force field (Ewald summation, no LAMMPS), using load_ff and
+# load_integrator of md.py, and the conserved energy (econs) is sampled every
+# frame (10 fs). A plain NVE run with VerletIntegrator gives the drift of the
+# 0.5 fs timestep itself. Reported per mode are the largest deviation of econs
+# from its initial value, which is dominated by the fluctuations while the
+# random initial velocities equilibrate, and the linear drift of econs. The
+# script exits with status 1 if the drift over the whole run exceeds --tol.
+#
+# Run from the MDrun folder, e.g.
+#   PYTHONPATH=. python benchmarks/npt_smoke.py --struct ABCDEF_all --steps 1000
+
+def run_mode(md, src, temp, mode, respa, steps):
+    # Time (fs) and econs (Ha) of every frame of a short run in a temporary
+    # folder, and the time per step
+    system = md.System.from_file(os.path.join(src, 'init.chk'))
+    ff = md.load_ff(system, os.path.join(src, 'pars.txt'), use_lammps = False)
+    workdir = tempfile.mkdtemp(prefix = 'md_smoke_')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        if mode == 'nve':
+            verlet = md.VerletIntegrator(ff, 0.5*femtosecond, temp0 = temp)
+        else:
+            verlet = md.load_integrator(ff, temp = temp, npt = mode, respa = respa)
+        step = md.get_frame_step(respa)
+        times, econs = [verlet.time], [verlet.econs]
+        t0 = time.time()
+        for i in range(steps//(respa*step)):
+            verlet.run(step)
+            times.append(verlet.time)
+            econs.append(verlet.econs)
+        walltime = time.time() - t0
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+    return np.array(times)/femtosecond, np.array(econs), walltime/max(steps//respa, 1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--temp', default = '293K')
+    parser.add_argument('--struct', default = 'ABCDEF_all')
+    parser.add_argument('--steps', type = int, default = 1000,
+            help = 'number of steps of 0.5 fs per mode')
+    parser.add_argument('--modes', nargs = '+', default = ['nve', 'mtk', 'virial', 'respa2'],
+            help = 'nve, mtk, virial or respaN (--npt virial --respa N)')
+    parser.add_argument('--tol', type = float, default = 2e-3,
+            help = 'largest allowed drift of econs over the run (Ha)')
+    parser.add_argument('--seed', type = int, default = 1)
+    args = parser.parse_args()
+
+    src = os.path.join(args.temp, args.struct)
+    md = load_md(src)
+    temp = float(args.temp.rstrip('K'))*kelvin
+    failed = []
+    print('# mode ms/step max|econs-econs0| (Ha) drift (Ha/ps) drift over the run (Ha)')
+    for mode in args.modes:
+        np.random.seed(args.seed)
+        respa = 1
+        if mode.startswith('respa'):
+            mode, respa = 'virial', int(mode[5:])
+        times, econs, time_step = run_mode(md, src, temp, mode, respa, args.steps)
+        deviation = np.abs(econs - econs[0]).max()
+        drift = np.polyfit(times, econs, 1)[0]*1000
+        change = drift*(times[-1] - times[0])/1000
+        label = mode if respa == 1 else 'respa{}'.format(respa)
+        print('{} {:.1f} {:.3e} {:.3e} {:.3e}'.format(label, 1000*time_step, deviation, drift, change))
+        sys.stdout.flush()
+        if not abs(change) < args.tol:
+            failed.append(label)
+    if len(failed) > 0:
+        print('FAILED econs drift above {:.1e} Ha: {}'.format(args.tol, ' '.join(failed)))
+        sys.exit(1)
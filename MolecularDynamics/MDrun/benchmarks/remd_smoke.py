@@ -0,0 +1,45 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+# Smoke test of remd.py: two replicas with the Yaff force field (no LAMMPS),
+# one rank each, for a few exchange cycles in a temporary folder. Reported are
+# the exchange attempts of exchange.jsonl; the script exits with status 1 if
+# there is none.
+#
+# Run from the MDrun folder, e.g.
+#   python benchmarks/remd_smoke.py --struct ABCDEF_all --steps 40 --exchange 20
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--struct', default = 'ABCDEF_all')
+    parser.add_argument('--temps', nargs = 2, default = ['293', '400'])
+    parser.add_argument('--steps', type = int, default = 40)
+    parser.add_argument('--exchange', type = int, default = 20)
+    parser.add_argument('--respa', type = int, default = 1)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix = 'remd_smoke_')
+    try:
+        command = ['mpirun', '-np', '2', 'python', 'remd.py', '--struct', args.struct, '--temps'] + args.temps + [
+                '--steps', str(args.steps), '--exchange', str(args.exchange), '--respa', str(args.respa),
+                '--no-lammps', '--folder', folder]
+        subprocess.check_call(command)
+        path = os.path.join(folder, args.struct)
+        attempts = []
+        if os.path.isfile(os.path.join(path, 'exchange.jsonl')):
+            with open(os.path.join(path, 'exchange.jsonl'), 'r') as f:
+                attempts = [json.loads(line) for line in f if line.strip()]
+        for attempt in attempts:
+            print('step = {step} pair = {pair} delta = {delta:.3f} accepted = {accepted}'.format(**attempt))
+        with open(os.path.join(path, 'remd.log'), 'r') as f:
+            sys.stdout.write(f.read())
+    finally:
+        shutil.rmtree(folder)
+    if len(attempts) == 0:
+        print('FAILED no exchange attempt')
+        sys.exit(1)
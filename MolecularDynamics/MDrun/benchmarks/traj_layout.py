@@ -0,0 +1,93 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import h5py as h5
+
+from molmod.units import angstrom
+
+from mpi_scaling import run
+
+from mdtools.trajectory import layouts, create_dataset
+
+# Compare the storage layouts of traj.h5 (see mdtools/trajectory.py). For
+# every layout, md.py runs a short trajectory (ms per step of the whole run),
+# after which the frames of the reference (yaff) trajectory are written again
+# in a fresh file to time the writer alone. Reported are the file size, the
+# write time per frame, the time to read one random frame (pos and cell, as
+# done by the analysis scripts) and the largest position error with respect
+# to the float64 reference.
+#
+# Run from the MDrun folder, e.g.
+#   PYTHONPATH=. python benchmarks/traj_layout.py --struct ABCDEF_all --steps 4000
+
+def rewrite(fn_src, fn_dst, layout):
+    # Write all frames of fn_src to fn_dst one by one, like HDF5Writer does,
+    # and return the average time per frame
+    with h5.File(fn_src, 'r') as src, h5.File(fn_dst, 'w') as dst:
+        data = dict((key, ds[:]) for key, ds in src['trajectory'].items())
+        nframe = min(len(value) for value in data.values())
+        t0 = time.time()
+        tgrp = dst.create_group('trajectory')
+        for key, value in data.items():
+            create_dataset(tgrp, key, value.shape[1:], value.dtype, layout = layout)
+        for row in range(nframe):
+            for key, value in data.items():
+                tgrp[key].resize(row + 1, axis = 0)
+                tgrp[key][row] = value[row]
+            dst.flush()
+        return (time.time() - t0)/nframe
+
+def read_random(fn, nread, seed = 5):
+    # Average time to read pos and cell of a random frame
+    with h5.File(fn, 'r') as f:
+        nframe = len(f['trajectory/pos'])
+        indices = np.random.RandomState(seed).randint(nframe, size = nread)
+        t0 = time.time()
+        for i in indices:
+            pos = f['trajectory/pos'][i]
+            rvecs = f['trajectory/cell'][i]
+        return (time.time() - t0)/nread
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--temp', default = '293K')
+    parser.add_argument('--struct', default = 'ABCDEF_all')
+    parser.add_argument('--steps', type = int, default = 4000)
+    parser.add_argument('--nread', type = int, default = 200)
+    parser.add_argument('--out', default = 'benchmarks/traj_layout.dat')
+    args = parser.parse_args()
+
+    cache = os.path.abspath('tables')
+    src = os.path.join(args.temp, args.struct)
+    tmpdir = tempfile.mkdtemp(prefix = 'traj_benchmark_')
+    fn_ref = os.path.join(tmpdir, 'traj_ref.h5')
+    with open(args.out, 'w') as f:
+        f.write('# layout ms/step MB ms/frame_write ms/frame_read max_dpos[A]\n')
+        results = {}
+        for layout in sorted(layouts, key = lambda layout: layout != 'yaff'):
+            nsday, workdir = run(src, 1, args.steps, cache, options = ['--traj', layout], keep = True)
+            ms_step = 86400e3/(nsday*1e6/0.5)
+            if layout == 'yaff':
+                shutil.copy(os.path.join(workdir, 'traj.h5'), fn_ref)
+            shutil.rmtree(workdir)
+            # Writer and reader on identical frames
+            fn = os.path.join(tmpdir, 'traj_{}.h5'.format(layout))
+            t_write = rewrite(fn_ref, fn, layout)
+            t_read = read_random(fn, args.nread)
+            size = os.path.getsize(fn)/1024.0**2
+            with h5.File(fn_ref, 'r') as ref, h5.File(fn, 'r') as traj:
+                dpos = np.abs(traj['trajectory/pos'][:] - ref['trajectory/pos'][:]).max()/angstrom
+            results[layout] = (ms_step, size, t_write, t_read)
+            line = '{} {:.2f} {:.2f} {:.3f} {:.3f} {:.2e}'.format(layout, ms_step, size, 1e3*t_write, 1e3*t_read, dpos)
+            print(line)
+            f.write(line + '\n')
+    shutil.rmtree(tmpdir)
+    ms_ref, size_ref, write_ref, read_ref = results['yaff']
+    for layout, (ms_step, size, t_write, t_read) in sorted(results.items()):
+        if layout == 'yaff': continue
+        print('{}: size x{:.2f}, write overhead {:+.3f} ms/frame ({:+.4f} ms/step), read x{:.2f}'.format(
+            layout, size/size_ref, 1e3*(t_write - write_ref), 1e3*(t_write - write_ref)/20, t_read/read_ref))
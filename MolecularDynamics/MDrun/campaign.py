@@ -0,0 +1,200 @@
+import os
+import re
+import sys
+import time
+import runpy
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+from mdtools.walltime import parse_walltime, resubmit_status
+
+# All MD simulations (structures x temperatures) in a single job.
+#
+# Instead of one PBS job per simulation, a pool of worker processes runs the
+# md.py of every <temp>/<struct> folder, each in its own process such that
+# LAMMPS instances are never shared. The non-bonded interactions are first
+# tabulated (and validated) once per structure in the tabulation cache, after
+# which all temperatures of that structure start from a cache hit.
+#
+# The simulations are restarted from traj.h5 when it exists, so the campaign
+# is continued by submitting it again. With --walltime, simulations stop in
+# time (see mdtools/walltime.py) and the campaign exits with status 99.
+#
+# With --warm-start, the simulations at the reference temperature (293K) run
+# first, and every other temperature starts from the end of the run at its
+# neighbouring temperature closer to the reference (md.py --warm-start), in
+# waves: 293K, then 77K and 400K, then 500K. A simulation whose source did not
+# finish is left for the next campaign job.
+#
+# Run from the MDrun folder, e.g.
+#   python campaign.py --workers 36 --walltime 72:00:00 > campaign.log
+
+temps = ['77K', '293K', '400K', '500K']
+
+def get_waves(temps, reference = '293K'):
+    # Lists of (temp, source temp) that can run in parallel, every source in
+    # an earlier wave. The reference temperature has no source.
+    kelvins = dict((temp, float(temp.rstrip('K'))) for temp in temps)
+    if reference not in temps:
+        reference = temps[0]
+    waves = [[(reference, None)]]
+    done = [reference]
+    while len(done) < len(temps):
+        wave = []
+        for temp in temps:
+            if temp in done: continue
+            # Source is the nearest temperature done so far, if it is the
+            # nearest on this side of the reference
+            source = min(done, key = lambda other: abs(kelvins[other] - kelvins[temp]))
+            between = [other for other in temps if other not in done and
+                    min(kelvins[source], kelvins[temp]) < kelvins[other] < max(kelvins[source], kelvins[temp])]
+            if len(between) == 0:
+                wave.append((temp, source))
+        done += [temp for temp, source in wave]
+        waves.append(wave)
+    return waves
+
+def run_md(folder, options, fn_log = 'md.log'):
+    # Run md.py of folder in this process, with stdout (also that of LAMMPS)
+    # appended to fn_log. Returns the exit status of md.py.
+    os.chdir(folder)
+    sys.stdout.flush()
+    with open(fn_log, 'a') as f:
+        os.dup2(f.fileno(), 1)
+        os.dup2(f.fileno(), 2)
+    sys.argv = ['md.py'] + options
+    status = 0
+    try:
+        runpy.run_path('md.py', run_name = '__main__')
+    except SystemExit as e:
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code, int):
+            status = e.code
+        else:
+            print(e.code)
+            status = 1
+    sys.stdout.flush()
+    return status
+
+def get_perf(fn_log):
+    # Steps, simulated time (ns) and ns/day of the last PERF line of md.py
+    steps, ns, nsday = 0, 0.0, 0.0
+    if os.path.isfile(fn_log):
+        with open(fn_log, 'r') as f:
+            for line in f:
+                match = re.search(r'PERF .* steps = ([0-9]+) walltime = ([0-9.]+) s ns/day = ([0-9.eE+-]+)', line)
+                if match is not None:
+                    steps, nsday = int(match.group(1)), float(match.group(3))
+                    ns = nsday*float(match.group(2))/86400
+    return steps, ns, nsday
+
+def tabulate(task):
+    # Fill the tabulation cache for one structure with a run of zero steps in
+    # a temporary folder
+    struct, src, options = task
+    workdir = tempfile.mkdtemp(prefix = 'campaign_{}_'.format(struct))
+    for fn in ['md.py', 'pars.txt', 'init.chk']:
+        shutil.copy(os.path.join(src, fn), workdir)
+    t0 = time.time()
+    status = run_md(workdir, options + ['--steps', '0'])
+    shutil.rmtree(workdir)
+    return struct, status, time.time() - t0
+
+def simulate(task):
+    folder, options, deadline, margin = task
+    if deadline is not None:
+        remaining = deadline - time.time()
+        if remaining < 2*margin:
+            # Not enough time left to start, done in the next campaign job
+            return folder, resubmit_status, 0.0, 0, 0.0, 0.0
+        options = options + ['--walltime', str(remaining), '--walltime-margin', str(margin)]
+    t0 = time.time()
+    status = run_md(folder, options)
+    steps, ns, nsday = 0, 0.0, 0.0
+    if status == 0 or status == resubmit_status:
+        steps, ns, nsday = get_perf(os.path.join(folder, 'md.log'))
+    return folder, status, time.time() - t0, steps, ns, nsday
+
+if __name__ == '__main__':
+    t_start = time.time()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--structs', nargs = '+', default = None)
+    parser.add_argument('--temps', nargs = '+', default = temps)
+    parser.add_argument('--workers', type = int, default = multiprocessing.cpu_count())
+    parser.add_argument('--nodes', type = int, default = 1,
+            help = 'number of nodes of the job, for the ns/day per node')
+    parser.add_argument('--walltime', default = None,
+            help = 'walltime of the campaign job ([[hh:]mm:]ss)')
+    parser.add_argument('--walltime-margin', type = float, default = 1200.0)
+    parser.add_argument('--cache', default = 'tables')
+    parser.add_argument('--warm-start', action = 'store_true',
+            help = 'start every temperature from the end of the run at a neighbouring temperature')
+    parser.add_argument('--md-options', nargs = argparse.REMAINDER, default = [],
+            help = 'remaining arguments are passed to every md.py (e.g. --npt virial)')
+    args = parser.parse_args()
+
+    structs = args.structs
+    if structs is None:
+        structs = sorted(os.listdir(args.temps[0]))
+    cache = os.path.abspath(args.cache)
+    options = ['--cache', cache] + args.md_options
+    deadline = None
+    if args.walltime is not None:
+        deadline = t_start + parse_walltime(args.walltime)
+    sys.path.insert(0, os.getcwd()) # mdtools for md.py
+
+    # One tabulation per structure
+    tasks = [(struct, os.path.abspath(os.path.join(args.temps[0], struct)), options) for struct in structs]
+    pool = multiprocessing.Pool(args.workers, maxtasksperchild = 1)
+    for struct, status, elapsed in pool.imap_unordered(tabulate, tasks):
+        print('TABULATE {} status = {} t = {:.1f} s'.format(struct, status, elapsed))
+        sys.stdout.flush()
+    t_tabulate = time.time() - t_start
+
+    # All simulations, restarted from traj.h5 if it exists
+    if args.warm_start:
+        waves = get_waves(args.temps)
+    else:
+        waves = [[(temp, None) for temp in args.temps]]
+    statuses = []
+    finished = set() # Folders of which md.py exited with status 0
+    ntask = 0
+    ns_total = 0.0
+    for wave in waves:
+        tasks = []
+        for struct in structs:
+            for temp, source in wave:
+                folder = os.path.abspath(os.path.join(temp, struct))
+                folder_options = options + ['--restart']
+                if source is not None:
+                    src = os.path.abspath(os.path.join(source, struct))
+                    if src not in finished:
+                        # Source not finished, done in the next campaign job
+                        print('MD {} waits for {}'.format(os.path.relpath(folder), os.path.relpath(src)))
+                        statuses.append(resubmit_status)
+                        continue
+                    folder_options += ['--warm-start', os.path.join(src, 'traj.h5')]
+                tasks.append((folder, folder_options, deadline, args.walltime_margin))
+        for folder, status, elapsed, steps, ns, nsday in pool.imap_unordered(simulate, tasks):
+            ns_total += ns
+            statuses.append(status)
+            if status == 0:
+                finished.add(folder)
+            print('MD {} status = {} t = {:.1f} s steps = {} ns/day = {:.4f}'.format(
+                os.path.relpath(folder), status, elapsed, steps, nsday))
+            sys.stdout.flush()
+        ntask += len(tasks)
+    pool.close()
+    pool.join()
+
+    walltime = time.time() - t_start
+    print('CAMPAIGN simulations = {} workers = {} tabulation = {:.1f} s walltime = {:.1f} s'.format(
+        ntask, args.workers, t_tabulate, walltime))
+    print('CAMPAIGN simulated = {:.4f} ns ns/day/node = {:.4f}'.format(ns_total, ns_total/(walltime/86400)/args.nodes))
+    if any(status == resubmit_status for status in statuses):
+        sys.exit(resubmit_status)
+    if any(status != 0 for status in statuses):
+        sys.exit(1)
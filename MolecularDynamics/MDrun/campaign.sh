@@ -0,0 +1,24 @@
+#!/bin/sh
+#
+#PBS -N _md_campaign
+#PBS -l walltime=72:00:00
+#PBS -l nodes=1:ppn=36
+#PBS -m n
+
+date
+
+# Run from the MDrun folder, all structures and temperatures in one job
+cd $PBS_O_WORKDIR
+NPROCS=$(cat $PBS_NODEFILE | wc -l)
+
+# Load modules
+module load LAMMPS/3Mar2020-foss-2019b-Python-3.7.4-kokkos # Load LAMMPS, also loads yaff
+
+# Run, stopping in time before the walltime of the #PBS line above
+python campaign.py --workers $NPROCS --walltime 72:00:00 >> campaign.log
+STATUS=$?
+
+# Not finished within the walltime, continue in a new job
+if [ $STATUS -eq 99 ]; then qsub campaign.sh; fi
+
+date
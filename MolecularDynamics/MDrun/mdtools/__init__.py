@@ -0,0 +1 @@
+# Shared helpers for the md.py scripts in MolecularDynamics/MDrun/<T>/<struct>/
@@ -0,0 +1,127 @@
+import numpy as np
+import h5py as h5
+
+from molmod import MolecularGraph
+
+from yaff.log import timer
+from yaff.sampling.iterative import Hook
+
+# Interlayer distance and layer offset during the MD run.
+#
+# The layers are the connected components of the bond graph
+# (MolecularGraph.independent_vertices), sorted along z as in
+# MDanalysis/scripts/plot_layer.py. For every pair of neighbouring layers
+# (i, i+1), and the last layer with the first one of the next cell along c,
+# the difference of the centers of mass is projected like CVCOMProjection
+# does: on a, on the vector perpendicular to a in the ab plane, and on the
+# normal of the ab plane. Periodic boundary conditions are not applied, as in
+# CVCOMProjection.
+#
+# LayerHook appends the projections to layers.h5:
+#   counter, time     (nframe,)
+#   projection        (nframe, npair, 3)
+#   layers/atoms      atom indices of all layers, concatenated
+#   layers/sizes      number of atoms per layer
+# The rows are buffered, and written when the buffer is full and whenever the
+# sync hook (the writer of the full frames of traj.h5) writes a frame. After a
+# hard kill, md.py --restart continues from the last full frame of traj.h5, and
+# all rows before it are then already in layers.h5.
+
+def get_layers(system):
+    # Atom indices of every layer, sorted along z
+    graph = MolecularGraph(system.bonds, system.numbers)
+    layers = [np.array(sorted(index)) for index in graph.independent_vertices]
+    return sorted(layers, key = lambda index: system.pos[index, 2].mean())
+
+def get_projection_frame(rvecs):
+    # Rows are the unit vectors of the frame of CVCOMProjection
+    x = rvecs[0]/np.linalg.norm(rvecs[0])
+    z = np.cross(rvecs[0], rvecs[1])
+    z /= np.linalg.norm(z)
+    y = np.cross(z, x)
+    return np.array([x, y, z])
+
+class LayerProjection(object):
+    def __init__(self, system, layers = None):
+        if layers is None:
+            layers = get_layers(system)
+        self.layers = layers
+        self.nlayer = len(layers)
+        # Layer of every atom, -1 for atoms in none of the layers
+        self.layer_ids = np.full(system.natom, -1)
+        for i, index in enumerate(layers):
+            self.layer_ids[index] = i
+        self.mask = self.layer_ids >= 0
+        if system.masses is None:
+            # As VerletIntegrator does, which is set up after the hooks
+            system.set_standard_masses()
+        self.weights = system.masses*self.mask
+        self.layer_masses = np.bincount(self.layer_ids[self.mask], self.weights[self.mask], self.nlayer)
+
+    def compute(self, pos, rvecs):
+        # Array (npair, 3) with the projected COM differences
+        ids = self.layer_ids[self.mask]
+        weights = self.weights[self.mask]
+        com = np.array([np.bincount(ids, weights*pos[self.mask, k], self.nlayer) for k in range(3)]).T
+        com /= self.layer_masses.reshape(-1, 1)
+        delta = np.roll(com, -1, axis = 0) - com
+        # Last layer with the first layer of the next cell along c
+        delta[-1] += rvecs[2]
+        return np.dot(delta, get_projection_frame(rvecs).T)
+
+class LayerHook(Hook):
+    def __init__(self, fn, system, start = 0, step = 1, nbuffer = 1000, mode = 'w', sync = None):
+        self.f = h5.File(fn, mode)
+        layers = None
+        if 'layers' in self.f:
+            # Appending after a restart, keep the layers of the first run
+            layers = np.split(self.f['layers/atoms'][:], np.cumsum(self.f['layers/sizes'][:])[:-1])
+        self.projection = LayerProjection(system, layers = layers)
+        self.nbuffer = nbuffer
+        self.buffer = []
+        self.sync = sync
+        self.first = True
+        Hook.__init__(self, start, step)
+
+    def init_file(self, counter):
+        npair = self.projection.nlayer
+        if 'projection' not in self.f:
+            self.f.create_dataset('counter', (0,), maxshape = (None,), dtype = int)
+            self.f.create_dataset('time', (0,), maxshape = (None,), dtype = float)
+            self.f.create_dataset('projection', (0, npair, 3), maxshape = (None, npair, 3),
+                    chunks = (self.nbuffer, npair, 3), dtype = float)
+            self.f['layers/atoms'] = np.concatenate(self.projection.layers)
+            self.f['layers/sizes'] = np.array([len(index) for index in self.projection.layers])
+        # After a restart, drop the rows of the steps that are done again
+        nrow = int(np.searchsorted(self.f['counter'][:], counter))
+        for key in ['counter', 'time', 'projection']:
+            self.f[key].resize(nrow, axis = 0)
+
+    def expects_call(self, counter):
+        # Also called on the full frames of the sync hook, to flush
+        if self.sync is not None and self.sync.expects_call(counter):
+            return True
+        return Hook.expects_call(self, counter)
+
+    def __call__(self, iterative):
+        with timer.section('Layers'):
+            if self.first:
+                self.init_file(iterative.counter)
+                self.first = False
+            if Hook.expects_call(self, iterative.counter):
+                system = iterative.ff.system
+                self.buffer.append((iterative.counter, iterative.time,
+                        self.projection.compute(system.pos, system.cell.rvecs)))
+            if len(self.buffer) >= self.nbuffer or \
+                    (self.sync is not None and self.sync.expects_call(iterative.counter)):
+                self.flush()
+
+    def flush(self):
+        if len(self.buffer) == 0:
+            return
+        nrow = self.f['counter'].shape[0]
+        for i, key in enumerate(['counter', 'time', 'projection']):
+            self.f[key].resize(nrow + len(self.buffer), axis = 0)
+            self.f[key][nrow:] = np.array([row[i] for row in self.buffer])
+        self.f.flush()
+        self.buffer = []
@@ -0,0 +1,225 @@
+import numpy as np
+
+from yaff.sampling.iterative import Iterative
+from yaff.sampling.verlet import VerletIntegrator, VerletHook
+from yaff.sampling.utils import get_ndof_internal_md, get_random_vel_press, clean_momenta
+
+from molmod.units import femtosecond
+from molmod.constants import boltzmann
+
+# NPT integration with a single force and virial evaluation per step.
+#
+# The TBCombination(NHCThermostat, MTKBarostat) hook of Yaff rescales the
+# positions and the cell outside of the regular Verlet step, after which the
+# forces and the virial are evaluated again ('VERLET special hooks' in the
+# TIMER overview). Here the MTK equations of motion are integrated with the
+# measure-preserving Trotter splitting of Tuckerman et al. (J. Phys. A 39,
+# 5629, 2006), in which the cell and the positions are propagated together.
+# The force call of the step then provides both the gradient and the virial
+# tensor for the next barostat update. The sampled (N,P,T) ensemble is the
+# same as with TBCombination(NHCThermostat, MTKBarostat): a Nose-Hoover chain
+# on the particles (which also thermostats the barostat) and a fully
+# flexible, rotation-free cell. The barostat mass, (ndof + 9) kT/omega^2, and
+# the random initial barostat velocities are those of MTKBarostat, so the
+# cell fluctuates on the same time scale.
+
+def _sinhc(x):
+    # sinh(x)/x, with a series expansion near zero
+    x = np.asarray(x, dtype = float)
+    result = np.ones(x.shape)
+    large = np.abs(x) > 1e-4
+    result[large] = np.sinh(x[large])/x[large]
+    small = ~large
+    result[small] = 1.0 + x[small]**2/6.0 + x[small]**4/120.0
+    return result
+
+class VirialMTKBarostat(VerletHook):
+    def __init__(self, temp, press, timecon_thermo = 100*femtosecond,
+            timecon_baro = 1000*femtosecond, chainlength = 3, restart = False):
+        self.temp = temp
+        self.press = press
+        self.timecon_thermo = timecon_thermo
+        self.timecon_baro = timecon_baro
+        self.chainlength = chainlength
+        self.restart = restart
+        # State of the barostat (velocity tensor, drawn in init) and the
+        # thermostat chain
+        self.vel_press = None
+        self.chain_pos = np.zeros(chainlength)
+        self.chain_vel = np.zeros(chainlength)
+        self.econs_correction = 0.0
+        VerletHook.__init__(self, start = 0, step = 1)
+
+    def init(self, iterative):
+        kt = boltzmann*self.temp
+        if not self.restart:
+            # Zero the external momenta, as NHCThermostat and MTKBarostat do
+            clean_momenta(iterative.pos, iterative.vel, iterative.masses, iterative.ff.system.cell)
+        # The hooks are initialized before VerletIntegrator sets ndof
+        if iterative.ndof is None:
+            iterative.ndof = get_ndof_internal_md(len(iterative.ff.system.numbers), iterative.ff.system.cell.nvec)
+        self.ndof = iterative.ndof
+        # Symmetric velocity tensor, no cell rotations
+        self.baro_ndof = 6
+        angfreq_thermo = 2*np.pi/self.timecon_thermo
+        angfreq_baro = 2*np.pi/self.timecon_baro
+        dim = iterative.ff.system.cell.nvec
+        self.mass_press = (self.ndof + dim**2)*kt/angfreq_baro**2
+        if self.vel_press is None:
+            # Random symmetric velocity tensor, as MTKBarostat (replaced by
+            # set_chain_state of mdtools.restart on a restart)
+            self.vel_press = get_random_vel_press(self.mass_press, self.temp)
+        self.chain_masses = np.ones(self.chainlength)*kt/angfreq_thermo**2
+        self.chain_masses[0] *= self.ndof + self.baro_ndof
+        # The integrator computes gpos and vtens together from here on, only
+        # the initial virial is not known yet
+        iterative.gpos[:] = 0.0
+        iterative.vtens[:] = 0.0
+        iterative.epot = iterative.ff.compute(iterative.gpos, iterative.vtens)
+        self.update_econs_correction(iterative)
+
+    def pre(self, iterative):
+        # The propagation is done by NPTVerletIntegrator
+        pass
+
+    def post(self, iterative):
+        pass
+
+    def get_ekin_tensor(self, iterative):
+        # Twice the kinetic energy tensor, sum_i m_i v_i v_i^T
+        return np.dot(iterative.vel.T*iterative.masses, iterative.vel)
+
+    def get_ekin2(self, iterative):
+        # Twice the kinetic energy of the particles and the barostat
+        return np.trace(self.get_ekin_tensor(iterative)) + self.mass_press*np.sum(self.vel_press**2)
+
+    def thermo(self, iterative, timestep):
+        # Half step of the Nose-Hoover chain, which is coupled to the
+        # particles and the barostat
+        kt = boltzmann*self.temp
+        m = self.chainlength
+        def force(j, k2):
+            if j == 0:
+                return (k2 - (self.ndof + self.baro_ndof)*kt)/self.chain_masses[0]
+            return (self.chain_masses[j-1]*self.chain_vel[j-1]**2 - kt)/self.chain_masses[j]
+        def update(j, k2):
+            if j < m - 1:
+                scale = np.exp(-0.125*timestep*self.chain_vel[j+1])
+                self.chain_vel[j] = (self.chain_vel[j]*scale + 0.25*timestep*force(j, k2))*scale
+            else:
+                self.chain_vel[j] += 0.25*timestep*force(j, k2)
+        k2 = self.get_ekin2(iterative)
+        for j in range(m - 1, -1, -1):
+            update(j, k2)
+        # Scale particle and barostat velocities
+        scale = np.exp(-0.5*timestep*self.chain_vel[0])
+        iterative.vel *= scale
+        self.vel_press *= scale
+        self.chain_pos += 0.5*timestep*self.chain_vel
+        k2 = self.get_ekin2(iterative)
+        for j in range(m):
+            update(j, k2)
+
+    def baro(self, iterative, timestep):
+        # Half step of the barostat velocity, using the virial of the last
+        # force evaluation
+        volume = iterative.ff.system.cell.volume
+        k2 = self.get_ekin_tensor(iterative)
+        g = k2 - iterative.vtens + (np.trace(k2)/self.ndof - self.press*volume)*np.identity(3)
+        g = 0.5*(g + g.T)
+        self.vel_press += 0.5*timestep*g/self.mass_press
+
+    def kick(self, iterative, timestep, gpos = None):
+        # Half step of the velocities, coupled to the barostat
+        if gpos is None:
+            gpos = iterative.gpos
+        evals, evecs = np.linalg.eigh(self.vel_press)
+        evals = evals + np.trace(self.vel_press)/self.ndof
+        vel = np.dot(iterative.vel, evecs)
+        acc = np.dot(-gpos/iterative.masses.reshape(-1, 1), evecs)
+        x = 0.25*timestep*evals
+        vel = vel*np.exp(-2*x) + 0.5*timestep*acc*np.exp(-x)*_sinhc(x)
+        iterative.vel[:] = np.dot(vel, evecs.T)
+
+    def drift(self, iterative, timestep):
+        # Full step of the positions and the cell
+        evals, evecs = np.linalg.eigh(self.vel_press)
+        pos = np.dot(iterative.pos, evecs)
+        vel = np.dot(iterative.vel, evecs)
+        x = 0.5*timestep*evals
+        pos = pos*np.exp(2*x) + timestep*vel*np.exp(x)*_sinhc(x)
+        iterative.pos[:] = np.dot(pos, evecs.T)
+        rvecs = np.dot(iterative.ff.system.cell.rvecs, evecs)*np.exp(timestep*evals)
+        iterative.ff.update_rvecs(np.dot(rvecs, evecs.T))
+
+    def update_econs_correction(self, iterative):
+        kt = boltzmann*self.temp
+        self.econs_correction = self.press*iterative.ff.system.cell.volume + \
+                0.5*self.mass_press*np.sum(self.vel_press**2) + \
+                0.5*np.sum(self.chain_masses*self.chain_vel**2) + \
+                (self.ndof + self.baro_ndof)*kt*self.chain_pos[0] + \
+                kt*np.sum(self.chain_pos[1:])
+
+class NPTVerletIntegrator(VerletIntegrator):
+    def __init__(self, ff, timestep, temp, press, timecon_thermo = 100*femtosecond,
+            timecon_baro = 1000*femtosecond, hooks = None, restart = False, **kwargs):
+        # restart: velocities (vel0) of an earlier run, which are not cleaned
+        self.npt = VirialMTKBarostat(temp, press, timecon_thermo = timecon_thermo,
+                timecon_baro = timecon_baro, restart = restart)
+        self.vtens = np.zeros((3, 3))
+        if hooks is None:
+            hooks = []
+        VerletIntegrator.__init__(self, ff, timestep, hooks = hooks + [self.npt],
+                temp0 = kwargs.pop('temp0', temp), **kwargs)
+
+    def propagate(self):
+        # Other specialized hooks (the NPT hook itself does nothing here)
+        self.call_verlet_hooks('pre')
+
+        # First half of the thermostat and the barostat
+        self.npt.thermo(self, self.timestep)
+        self.npt.baro(self, self.timestep)
+
+        # Velocities, positions and cell
+        self.propagate_particles()
+
+        # Second half of the barostat and the thermostat
+        self.npt.baro(self, self.timestep)
+        self.npt.thermo(self, self.timestep)
+        self.ekin = self._compute_ekin()
+        self.npt.update_econs_correction(self)
+
+        self.call_verlet_hooks('post')
+
+        # Total position change, identical to VerletIntegrator
+        self.posnieuw = self.pos.copy()
+        self.delta[:] = self.posnieuw - self.posoud
+        self.posoud[:] = self.posnieuw
+
+        # Common post-processing of a single step
+        self.time += self.timestep
+        self.compute_properties()
+        Iterative.propagate(self)
+
+    def reset_forces(self):
+        # Energy, gradient and virial after the positions or the cell were
+        # changed outside of the integrator (e.g. a replica exchange)
+        self.ff.update_pos(self.pos)
+        self.gpos[:] = 0.0
+        self.vtens[:] = 0.0
+        self.epot = self.ff.compute(self.gpos, self.vtens)
+        self.acc = -self.gpos/self.masses.reshape(-1, 1)
+        self.posoud[:] = self.pos
+        self.npt.update_econs_correction(self)
+
+    def propagate_particles(self):
+        # Positions and cell, with the only force evaluation of the step in
+        # between the two velocity half steps
+        self.npt.kick(self, self.timestep)
+        self.npt.drift(self, self.timestep)
+        self.ff.update_pos(self.pos)
+        self.gpos[:] = 0.0
+        self.vtens[:] = 0.0
+        self.epot = self.ff.compute(self.gpos, self.vtens)
+        self.acc = -self.gpos/self.masses.reshape(-1, 1)
+        self.npt.kick(self, self.timestep)
@@ -0,0 +1,83 @@
+import numpy as np
+
+from yaff.pes.ff import ForceField
+
+from mdtools.npt import NPTVerletIntegrator
+
+# Reversible multiple time step (r-RESPA) integration in the (N,P,T) ensemble.
+#
+# The bonded Valence part evaluated by Yaff changes fast and is cheap, while
+# the non-covalent part (LAMMPS tabulation, tail corrections, ...) changes
+# slowly and dominates the cost. The valence forces are integrated with the
+# inner timestep, the non-covalent forces only with the outer timestep
+# (nrespa inner steps). The thermostat and barostat of NPTVerletIntegrator act
+# on the outer step, with the virial of the last inner evaluation plus the one
+# of the last outer evaluation, which both belong to the current geometry.
+
+def split_forcefield(ff):
+    # Fast (valence) and slow (all other) parts, sharing the system of ff
+    fast = [part for part in ff.parts if part.name.startswith('valence')]
+    slow = [part for part in ff.parts if not part.name.startswith('valence')]
+    if len(fast) == 0 or len(slow) == 0:
+        raise ValueError('Could not split the force field parts {} in valence and non-covalent parts'.format(
+            [part.name for part in ff.parts]))
+    return ForceField(ff.system, fast), ForceField(ff.system, slow, ff.nlist)
+
+class RESPAIntegrator(NPTVerletIntegrator):
+    def __init__(self, ff, timestep, temp, press, nrespa = 4, **kwargs):
+        # timestep is the outer timestep, the valence part is integrated with
+        # timestep/nrespa
+        self.nrespa = nrespa
+        self.ff_fast, self.ff_slow = split_forcefield(ff)
+        self.gpos_fast = np.zeros((ff.system.natom, 3))
+        self.gpos_slow = np.zeros((ff.system.natom, 3))
+        self.vtens_fast = np.zeros((3, 3))
+        self.vtens_slow = np.zeros((3, 3))
+        self.epot_fast = None
+        self.epot_slow = None
+        NPTVerletIntegrator.__init__(self, ff, timestep, temp, press, **kwargs)
+
+    def compute_fast(self):
+        self.ff_fast.update_pos(self.pos)
+        self.gpos_fast[:] = 0.0
+        self.vtens_fast[:] = 0.0
+        self.epot_fast = self.ff_fast.compute(self.gpos_fast, self.vtens_fast)
+
+    def compute_slow(self):
+        self.ff_slow.update_pos(self.pos)
+        self.gpos_slow[:] = 0.0
+        self.vtens_slow[:] = 0.0
+        self.epot_slow = self.ff_slow.compute(self.gpos_slow, self.vtens_slow)
+
+    def reset_forces(self):
+        self.compute_fast()
+        self.compute_slow()
+        self.epot = self.epot_fast + self.epot_slow
+        self.gpos[:] = self.gpos_fast + self.gpos_slow
+        self.vtens[:] = self.vtens_fast + self.vtens_slow
+        self.acc = -self.gpos/self.masses.reshape(-1, 1)
+        self.posoud[:] = self.pos
+        self.npt.update_econs_correction(self)
+
+    def propagate_particles(self):
+        if self.epot_slow is None:
+            # Split the forces of the initial geometry
+            self.compute_fast()
+            self.compute_slow()
+        timestep_inner = self.timestep/self.nrespa
+        # Outer half step with the non-covalent forces
+        self.vel -= 0.5*self.timestep*self.gpos_slow/self.masses.reshape(-1, 1)
+        # Inner steps with the valence forces, coupled to the barostat
+        for i in range(self.nrespa):
+            self.npt.kick(self, timestep_inner, gpos = self.gpos_fast)
+            self.npt.drift(self, timestep_inner)
+            self.compute_fast()
+            self.npt.kick(self, timestep_inner, gpos = self.gpos_fast)
+        # Outer half step with the non-covalent forces of the new geometry
+        self.compute_slow()
+        self.vel -= 0.5*self.timestep*self.gpos_slow/self.masses.reshape(-1, 1)
+        # Total energy, gradient and virial, used by the barostat and the output
+        self.epot = self.epot_fast + self.epot_slow
+        self.gpos[:] = self.gpos_fast + self.gpos_slow
+        self.vtens[:] = self.vtens_fast + self.vtens_slow
+        self.acc = -self.gpos/self.masses.reshape(-1, 1)
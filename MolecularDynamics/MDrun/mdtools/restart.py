@@ -0,0 +1,105 @@
+import numpy as np
+import h5py as h5
+
+from yaff.sampling.iterative import StateItem
+
+# Restart of md.py from the last complete frame in traj.h5.
+#
+# Positions, velocities, cell, time and counter are part of the default
+# trajectory of Yaff. The state of the Nose-Hoover chain and the barostat
+# velocity are not, so they are added to the trajectory as extra state items
+# (chain_pos, chain_vel, vel_press). A job killed at the walltime can then be
+# continued with identical equations of motion, appending to traj.h5: the
+# hooks are set up in restart mode, such that the momenta are not cleaned and
+# the cell is not symmetrized again.
+#
+# A frame is complete when every dataset has a row for it: the writer extends
+# the datasets one by one, so an interrupted write (or a copy of traj.h5 made
+# during a write) can leave some datasets one row longer.
+#
+# A run at another temperature can start from the same frame (warm start):
+# the positions and cell are taken over, the velocities are rescaled with
+# sqrt(T/T_src), where T_src is the mean temperature of the last part of the
+# source run. Time, counter and the thermostat chain start from scratch.
+
+chain_keys = ['chain_pos', 'chain_vel', 'vel_press']
+
+class FunctionStateItem(StateItem):
+    def __init__(self, key, function):
+        self.function = function
+        StateItem.__init__(self, key)
+
+    def get_value(self, iterative):
+        return np.array(self.function(iterative), dtype = float)
+
+    def copy(self):
+        return self.__class__(self.key, self.function)
+
+def get_chain_state(npt, thermo = None, baro = None):
+    # State items of the thermostat chain and the barostat velocity
+    if npt == 'mtk':
+        # Yaff's NHCThermostat and MTKBarostat in a TBCombination
+        functions = [
+            lambda iterative: thermo.chain.pos,
+            lambda iterative: thermo.chain.vel,
+            lambda iterative: baro.vel_press,
+        ]
+    else:
+        # VirialMTKBarostat of NPTVerletIntegrator (and RESPAIntegrator)
+        functions = [
+            lambda iterative: iterative.npt.chain_pos,
+            lambda iterative: iterative.npt.chain_vel,
+            lambda iterative: iterative.npt.vel_press,
+        ]
+    return [FunctionStateItem(key, function) for key, function in zip(chain_keys, functions)]
+
+def read_restart(fn):
+    # Last complete frame of the trajectory, or None if there is none
+    with h5.File(fn, 'r') as f:
+        if 'trajectory' not in f:
+            return None
+        tgrp = f['trajectory']
+        nframe = min(ds.shape[0] for ds in tgrp.values())
+        if nframe == 0:
+            return None
+        restart = {'nframe': nframe}
+        for key in ['pos', 'vel', 'cell', 'counter', 'time'] + chain_keys:
+            if key in tgrp:
+                restart[key] = tgrp[key][nframe - 1]
+        return restart
+
+def read_warm_start(fn, temp, tail = 0.5):
+    # Last complete frame of another run, with velocities rescaled to temp
+    restart = read_restart(fn)
+    if restart is None:
+        return None
+    with h5.File(fn, 'r') as f:
+        grp = f['thermo'] if 'thermo' in f else f['trajectory']
+        temps = grp['temp'][:]
+    temp_src = temps[int(len(temps)*(1 - tail)):].mean()
+    scale = np.sqrt(temp/temp_src)
+    return {
+        'pos': restart['pos'],
+        'cell': restart['cell'],
+        'vel': restart['vel']*scale,
+        'temp_src': temp_src,
+        'time_src': restart['time'],
+        'scale': scale,
+    }
+
+def get_chain_kwargs(restart):
+    # State of the thermostat chain and the barostat of the restarted run,
+    # or an empty dict for a trajectory without it (the chain starts from
+    # scratch)
+    if not all(key in restart for key in chain_keys):
+        return {}
+    return dict((key, np.array(restart[key], dtype = float)) for key in chain_keys)
+
+def set_chain_state(verlet, chain):
+    # Continue the chain and the barostat of NPTVerletIntegrator (and
+    # RESPAIntegrator). Yaff's NHCThermostat and MTKBarostat take the same
+    # state as chain_pos0, chain_vel0 and vel_press0 instead.
+    verlet.npt.chain_pos[:] = chain['chain_pos']
+    verlet.npt.chain_vel[:] = chain['chain_vel']
+    verlet.npt.vel_press[:] = chain['vel_press']
+    verlet.npt.update_econs_correction(verlet)
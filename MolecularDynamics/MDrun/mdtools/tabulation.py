@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+
+import numpy as np
+
+# Persistent cache of the LAMMPS tabulation files (table.dat) written by
+# swap_noncovalent_lammps. The table only depends on the force field
+# parameters, the force field settings and the atom types, so all
+# temperatures of one structure (and every restart) can share one table.
+#
+# Layout of the cache folder:
+#   <key>.dat       tabulated non-bonded interactions
+#   <key>.json      metadata (time it took to tabulate, settings)
+#   events.jsonl    one line per lookup (hit/miss), used for the statistics
+#
+# Statistics of a cache folder can be printed with
+#   python -m mdtools.tabulation <folder>
+
+def _write_atomic(fn, data = None, fn_src = None):
+    # Write to a temporary file in the same folder and rename it, such that
+    # concurrent jobs never read a half-written file
+    fn_tmp = '{}.{}.tmp'.format(fn, os.getpid())
+    if fn_src is not None:
+        shutil.copyfile(fn_src, fn_tmp)
+    else:
+        with open(fn_tmp, 'w') as f:
+            f.write(data)
+    os.rename(fn_tmp, fn)
+
+def get_supercell_reps(system, rcut):
+    # Number of repetitions along each cell vector such that the perpendicular
+    # widths of the supercell are at least twice the cutoff
+    return tuple(int(max(1, np.ceil(2*rcut/width))) for width in system.cell.rspacings)
+
+class TabulationCache(object):
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+        self.hits = 0
+        self.misses = 0
+        self.saved = 0.0
+
+    def get_key(self, system, fn_pars, ff_kwargs):
+        # Hash of the parameter file, the force field settings, the atom types
+        # and the cell shape
+        h = hashlib.sha256()
+        with open(fn_pars, 'rb') as f:
+            h.update(f.read())
+        h.update(json.dumps(ff_kwargs, sort_keys = True).encode())
+        h.update(' '.join(system.ffatypes).encode())
+        h.update(np.asarray(system.ffatype_ids, dtype = np.int64).tobytes())
+        h.update(np.asarray(system.numbers, dtype = np.int64).tobytes())
+        h.update(np.round(system.cell.rvecs, 6).tobytes())
+        return h.hexdigest()[:20]
+
+    def _fn(self, key, ext):
+        return os.path.join(self.path, '{}.{}'.format(key, ext))
+
+    def fetch(self, key, fn_table):
+        # Copy the cached table to fn_table and return True if it exists.
+        # On a miss, a stale fn_table is removed such that it is not silently
+        # reused by swap_noncovalent_lammps.
+        if os.path.isfile(self._fn(key, 'dat')):
+            shutil.copyfile(self._fn(key, 'dat'), fn_table)
+            return True
+        if os.path.isfile(fn_table):
+            os.remove(fn_table)
+        return False
+
+    def record(self, key, hit, elapsed, fn_table, info = None):
+        # Store the table after a miss, update the statistics and report
+        saved = 0.0
+        if hit:
+            self.hits += 1
+            meta = self.get_meta(key)
+            if meta is not None:
+                saved = max(meta['tabulation'] - elapsed, 0.0)
+            self.saved += saved
+        else:
+            self.misses += 1
+            _write_atomic(self._fn(key, 'dat'), fn_src = fn_table)
+            meta = {'tabulation': elapsed, 'created': time.time()}
+            if info is not None:
+                meta.update(info)
+            _write_atomic(self._fn(key, 'json'), json.dumps(meta, sort_keys = True))
+        event = {'key': key, 'hit': hit, 'elapsed': elapsed, 'saved': saved,
+                'time': time.time(), 'cwd': os.getcwd()}
+        with open(os.path.join(self.path, 'events.jsonl'), 'a') as f:
+            f.write(json.dumps(event, sort_keys = True) + '\n')
+        print('TABCACHE {} key = {} t = {:.1f} s saved = {:.1f} s'.format(
+            'hit ' if hit else 'miss', key, elapsed, saved))
+        print('TABCACHE this run: hits = {} misses = {} saved = {:.1f} s'.format(
+            self.hits, self.misses, self.saved))
+
+    def get_meta(self, key):
+        fn = self._fn(key, 'json')
+        if not os.path.isfile(fn):
+            return None
+        with open(fn, 'r') as f:
+            return json.load(f)
+
+    def update_meta(self, key, info):
+        meta = self.get_meta(key)
+        if meta is None:
+            return
+        meta.update(info)
+        _write_atomic(self._fn(key, 'json'), json.dumps(meta, sort_keys = True))
+
+    def summary(self):
+        # Aggregate hit/miss counts and saved startup time over all runs
+        hits, misses, saved = 0, 0, 0.0
+        fn = os.path.join(self.path, 'events.jsonl')
+        if os.path.isfile(fn):
+            with open(fn, 'r') as f:
+                for line in f:
+                    if not line.strip(): continue
+                    event = json.loads(line)
+                    if event['hit']:
+                        hits += 1
+                        saved += event['saved']
+                    else:
+                        misses += 1
+        return hits, misses, saved
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        hits, misses, saved = TabulationCache(path).summary()
+        print('{}: hits = {} misses = {} saved = {:.1f} s'.format(path, hits, misses, saved))
@@ -0,0 +1,99 @@
+import os
+import sys
+import json
+import time
+import resource
+
+from yaff.log import timer
+from yaff.sampling.iterative import Hook
+
+# Performance records during the MD run.
+#
+# The TIMER table of Yaff is only printed at the end of md.log. TelemetryHook
+# appends one JSON line to telemetry.jsonl every N steps with the time spent
+# in every timer section since the previous record (LAMMPS, LAMMPS overhead,
+# Valence, PP ei, VERLET hooks, HDF5 writer, Layers, ...), the steps per
+# second, ns/day and the memory use of the process. Timer sections report
+# CPU time (own time, excluding nested sections, up to the moment of the
+# record also for the open sections), steps per second uses the wall time.
+#
+# The records of several runs can be summarized with
+#   python -m mdtools.telemetry <temp>/<struct>/telemetry.jsonl ...
+
+def get_memory():
+    # Current and peak resident set size in MB
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+    rss = None
+    if os.path.isfile('/proc/self/statm'):
+        with open('/proc/self/statm', 'r') as f:
+            rss = int(f.read().split()[1])*resource.getpagesize()/1024.0**2
+    return rss, maxrss
+
+def get_timers():
+    # Own CPU time of every timer section so far. The hook is called while
+    # some sections are still open (Total, VERLET, VERLET hooks): a running
+    # timer only adds its time when it stops, so the time since it was
+    # started is added here, with the same clock as the timers of Yaff.
+    now = time.process_time()
+    timers = {}
+    for label, part in timer.parts.items():
+        timers[label] = part.own.cpu
+        if part.own._start is not None:
+            timers[label] += now - part.own._start
+    return timers
+
+class TelemetryHook(Hook):
+    def __init__(self, fn = 'telemetry.jsonl', start = 0, step = 1000, timestep = None):
+        self.fn = fn
+        self.timestep = timestep
+        self.last = None
+        Hook.__init__(self, start, step)
+
+    def __call__(self, iterative):
+        now = time.time()
+        timers = get_timers()
+        if self.last is not None:
+            counter, wall, last_timers = self.last
+            nstep = iterative.counter - counter
+            elapsed = now - wall
+            rss, maxrss = get_memory()
+            record = {
+                'counter': iterative.counter,
+                'time': now,
+                'steps': nstep,
+                'elapsed': elapsed,
+                'steps_per_s': nstep/elapsed,
+                'rss_mb': rss,
+                'maxrss_mb': maxrss,
+                'timers': dict((label, value - last_timers.get(label, 0.0))
+                        for label, value in timers.items()),
+            }
+            if self.timestep is not None:
+                record['ns_per_day'] = nstep*self.timestep/elapsed*86400*1e-6
+            with open(self.fn, 'a') as f:
+                f.write(json.dumps(record, sort_keys = True) + '\n')
+        self.last = (iterative.counter, now, timers)
+
+def summarize(fn):
+    # Mean steps per second, fraction of the CPU time per section and peak
+    # memory of one telemetry file
+    steps, elapsed, maxrss, timers = 0, 0.0, 0.0, {}
+    with open(fn, 'r') as f:
+        for line in f:
+            if not line.strip(): continue
+            record = json.loads(line)
+            steps += record['steps']
+            elapsed += record['elapsed']
+            maxrss = max(maxrss, record['maxrss_mb'])
+            for label, value in record['timers'].items():
+                timers[label] = timers.get(label, 0.0) + value
+    return steps, elapsed, maxrss, timers
+
+if __name__ == '__main__':
+    for fn in sys.argv[1:]:
+        steps, elapsed, maxrss, timers = summarize(fn)
+        total = sum(timers.values())
+        print('{}: steps = {} steps/s = {:.3f} maxrss = {:.0f} MB'.format(fn, steps, steps/max(elapsed, 1e-12), maxrss))
+        for label, value in sorted(timers.items(), key = lambda item: -item[1]):
+            if value > 0.001*total:
+                print('    {:20s} {:10.1f} s {:5.1f}%'.format(label, value, 100*value/total))
@@ -0,0 +1,148 @@
+import numpy as np
+
+from yaff.log import timer
+from yaff.sampling.io import HDF5Writer
+from yaff.sampling.iterative import Hook
+
+# Storage layouts of the trajectory datasets in traj.h5.
+#
+#   yaff        datasets as created by Yaff's HDF5Writer (float64, chunk shape
+#               guessed by h5py, no compression)
+#   chunked     one chunk per frame for the per-atom arrays (pos, vel, ...)
+#               and chunks of many frames for the small ones (cell, volume,
+#               ...), lossless gzip compression with the shuffle filter
+#   chunked32   as chunked, but pos and vel are stored in single precision
+#
+# The analysis scripts read the datasets with h5py and are not affected by
+# the layout. MDrun/benchmarks/traj_layout.py compares the file size, the
+# write time per frame and the time to read a random frame.
+#
+# Independent of the layout, a write policy can separate the equilibration
+# from the production phase (PolicyHDF5Writer and ThermoWriter):
+#   thermo        cell, volume, energies, temperature, pressure, ... every
+#                 thermo step for the whole run (no per-atom arrays)
+#   trajectory    full frames every production step from the start of the
+#                 production phase on, and before that only every checkpoint
+#                 step (the restart frames of md.py --restart)
+
+layouts = {
+    'yaff': None,
+    'chunked': {'compression': 'gzip', 'compression_opts': 4, 'float32': False},
+    'chunked32': {'compression': 'gzip', 'compression_opts': 4, 'float32': True},
+}
+
+# Datasets that may be stored in single precision
+float32_keys = ['pos', 'vel']
+
+# Frames larger than frame_bytes (the per-atom arrays) get their own chunk,
+# smaller ones are grouped in chunks of about chunk_bytes
+frame_bytes = 4096
+chunk_bytes = 65536
+
+def get_dataset_kwargs(key, shape, dtype, compression = 'gzip', compression_opts = 4, float32 = False):
+    # Arguments of create_dataset for one trajectory item with the given
+    # shape (without the frame axis)
+    dtype = np.dtype(dtype)
+    if float32 and key in float32_keys and dtype == np.float64:
+        dtype = np.dtype(np.float32)
+    framebytes = int(np.prod(shape, dtype = int))*dtype.itemsize
+    if framebytes >= frame_bytes:
+        nframe = 1
+    else:
+        nframe = chunk_bytes//max(1, framebytes)
+    return {
+        'dtype': dtype,
+        'chunks': (nframe,) + tuple(shape),
+        'compression': compression,
+        'compression_opts': compression_opts,
+        'shuffle': compression is not None,
+    }
+
+def create_dataset(tgrp, key, shape, dtype, layout = 'yaff'):
+    # Empty, resizable dataset for one trajectory item
+    options = layouts[layout]
+    if options is None:
+        # Identical to HDF5Writer.init_trajectory
+        return tgrp.create_dataset(key, (0,) + tuple(shape), maxshape = (None,) + tuple(shape), dtype = dtype)
+    kwargs = get_dataset_kwargs(key, shape, dtype, **options)
+    return tgrp.create_dataset(key, (0,) + tuple(shape), maxshape = (None,) + tuple(shape), **kwargs)
+
+class LayoutHDF5Writer(HDF5Writer):
+    def __init__(self, f, start = 0, step = 1, layout = 'yaff'):
+        if layout not in layouts:
+            raise ValueError('Trajectory layout should be one of {}, got {}'.format(sorted(layouts), layout))
+        self.layout = layout
+        HDF5Writer.__init__(self, f, start = start, step = step)
+
+    def __call__(self, iterative):
+        # Separate entry in the timer, see mdtools/telemetry.py
+        with timer.section('HDF5 writer'):
+            HDF5Writer.__call__(self, iterative)
+            # Every full frame is a restart frame, also after a hard kill
+            self.f.flush()
+
+    def init_trajectory(self, iterative):
+        tgrp = self.f.create_group('trajectory')
+        for key, item in iterative.state.items():
+            if len(item.shape) > 0 and min(item.shape) == 0:
+                continue
+            if item.value is None:
+                continue
+            create_dataset(tgrp, key, item.shape, item.dtype, layout = self.layout)
+            for name, value in item.iter_attrs(iterative):
+                tgrp.attrs[name] = value
+
+class PolicyHDF5Writer(LayoutHDF5Writer):
+    def __init__(self, f, production, production_step, checkpoint_step, after = -1, layout = 'yaff'):
+        # Full frames in the production phase (counter >= production) every
+        # production_step steps, before that every checkpoint_step steps. No
+        # frames up to after (the restart frame).
+        self.production = production
+        self.production_step = production_step
+        self.checkpoint_step = checkpoint_step
+        self.after = after
+        LayoutHDF5Writer.__init__(self, f, start = 0, step = 1, layout = layout)
+
+    def expects_call(self, counter):
+        if counter <= self.after:
+            return False
+        if counter < self.production:
+            return counter % self.checkpoint_step == 0
+        return (counter - self.production) % self.production_step == 0
+
+class ThermoWriter(Hook):
+    def __init__(self, f, start = 0, step = 1, layout = 'yaff'):
+        # All state items that are not per-atom arrays, in the thermo group
+        self.f = f
+        self.layout = layout
+        self.first = True
+        Hook.__init__(self, start, step)
+
+    def get_items(self, iterative):
+        for key, item in iterative.state.items():
+            if item.value is None or (len(item.shape) > 0 and min(item.shape) == 0):
+                continue
+            if len(item.shape) > 0 and item.shape[0] == iterative.ff.system.natom:
+                continue
+            yield key, item
+
+    def __call__(self, iterative):
+        with timer.section('HDF5 writer'):
+            if 'thermo' not in self.f:
+                tgrp = self.f.create_group('thermo')
+                for key, item in self.get_items(iterative):
+                    create_dataset(tgrp, key, item.shape, item.dtype, self.layout)
+            tgrp = self.f['thermo']
+            if self.first:
+                # After a restart, drop the rows of the steps that are done again
+                nrow = int(np.searchsorted(tgrp['counter'][:], iterative.counter))
+                for key in tgrp:
+                    tgrp[key].resize(nrow, axis = 0)
+                self.first = False
+            row = min(tgrp[key].shape[0] for key in tgrp)
+            for key, item in self.get_items(iterative):
+                tgrp[key].resize(row + 1, axis = 0)
+                tgrp[key][row] = item.value
+
+def get_writer(f, layout = 'yaff', start = 0, step = 1):
+    return LayoutHDF5Writer(f, start = start, step = step, layout = layout)
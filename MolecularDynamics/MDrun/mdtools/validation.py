@@ -0,0 +1,90 @@
+import json
+import time
+
+import numpy as np
+
+from yaff.sampling.iterative import Hook
+
+from molmod.units import angstrom, bar, kjmol
+
+# Consistency check of the LAMMPS force field against the Yaff reference
+# (Ewald summation). The reference evaluation is expensive for the large
+# cells, so it can be switched off, done once per tabulation (cache entry)
+# or repeated every N steps during the MD run to monitor drift. The results
+# are appended as JSON lines to fn_out.
+
+modes = ['off', 'once', 'every']
+
+def compare(ff, ff_lammps):
+    # Evaluate both force fields in the current geometry (they share the
+    # same System instance)
+    natom = ff.system.natom
+    gpos, vtens = np.zeros((natom, 3)), np.zeros((3, 3))
+    gpos_lammps, vtens_lammps = np.zeros((natom, 3)), np.zeros((3, 3))
+    ff.update_pos(ff_lammps.system.pos)
+    ff.update_rvecs(ff_lammps.system.cell.rvecs)
+    e = ff.compute(gpos, vtens)
+    e_lammps = ff_lammps.compute(gpos_lammps, vtens_lammps)
+    volume = ff.system.cell.volume
+    p = np.trace(vtens)/3.0/volume
+    p_lammps = np.trace(vtens_lammps)/3.0/volume
+    return {
+            'e_yaff': e/kjmol,
+            'e_lammps': e_lammps/kjmol,
+            'de': (e_lammps - e)/kjmol,
+            'p_yaff': p/bar,
+            'p_lammps': p_lammps/bar,
+            'dp': (p_lammps - p)/bar,
+            'dgpos_max': np.abs(gpos_lammps - gpos).max()/(kjmol/angstrom),
+    }
+
+class Validation(object):
+    def __init__(self, mode = 'once', step = 1000, fn_out = 'validation.jsonl', do_write = True):
+        if mode not in modes:
+            raise ValueError('Validation mode should be one of {}, got {}'.format(modes, mode))
+        self.mode = mode
+        self.step = step
+        self.fn_out = fn_out
+        self.do_write = do_write
+        self.ff = None
+        self.ff_lammps = None
+
+    def write(self, record):
+        if not self.do_write: return
+        with open(self.fn_out, 'a') as f:
+            f.write(json.dumps(record, sort_keys = True) + '\n')
+
+    def check(self, counter, label):
+        t0 = time.time()
+        record = compare(self.ff, self.ff_lammps)
+        record.update({'step': counter, 'label': label, 'elapsed': time.time() - t0})
+        self.write(record)
+        return record
+
+    def startup(self, ff, ff_lammps, cache = None, key = None):
+        # Called by load_ff once both force fields are available
+        self.ff = ff
+        self.ff_lammps = ff_lammps
+        if self.mode == 'off' or self.mode == 'every':
+            # In the 'every' mode, the hook also checks the first step
+            return
+        if self.mode == 'once' and cache is not None:
+            meta = cache.get_meta(key)
+            if meta is not None and 'validation' in meta:
+                # This tabulation was validated by an earlier run
+                return
+        record = self.check(0, 'startup')
+        if cache is not None and self.do_write:
+            cache.update_meta(key, {'validation': record})
+
+    def get_hook(self):
+        if self.mode == 'every':
+            return ValidationHook(self, step = self.step)
+
+class ValidationHook(Hook):
+    def __init__(self, validation, start = 0, step = 1000):
+        self.validation = validation
+        Hook.__init__(self, start, step)
+
+    def __call__(self, iterative):
+        self.validation.check(iterative.counter, 'md')
@@ -0,0 +1,51 @@
+import time
+
+# Walltime budget of an MD job.
+#
+# md.py integrates in chunks that end on a frame of traj.h5. After every
+# chunk, the time per step is estimated and the run stops when the next
+# chunk would not fit in the remaining budget (minus a margin for copying
+# the results back). traj.h5 then ends on a complete frame, md.py exits with
+# resubmit_status and md.sh resubmits itself, after which md.py --restart
+# continues from that frame.
+
+# Exit status of md.py when the run is stopped before --steps is reached
+resubmit_status = 99
+
+def parse_walltime(walltime):
+    # Seconds from [[hh:]mm:]ss, as in the PBS walltime resource
+    seconds = 0.0
+    for field in walltime.split(':'):
+        seconds = 60*seconds + float(field)
+    return seconds
+
+class WalltimeBudget(object):
+    def __init__(self, walltime, margin = 1200.0, safety = 1.5, t0 = None):
+        # walltime and margin in seconds, t0 is the start of the job
+        self.walltime = walltime
+        self.margin = margin
+        self.safety = safety
+        self.t0 = time.time() if t0 is None else t0
+        self.time_per_step = None
+        self.nstep = 0
+        self.elapsed = 0.0
+
+    def remaining(self):
+        return self.walltime - (time.time() - self.t0)
+
+    def update(self, nstep, elapsed):
+        # Time per step from the last chunk, the largest recent value is used
+        # such that a slow chunk (e.g. a busy file system) is not averaged away
+        self.nstep += nstep
+        self.elapsed += elapsed
+        current = elapsed/nstep
+        if self.time_per_step is None:
+            self.time_per_step = current
+        else:
+            self.time_per_step = max(current, 0.9*self.time_per_step + 0.1*current)
+
+    def fits(self, nstep):
+        # Can another nstep steps be done before the margin is reached?
+        if self.time_per_step is None:
+            return self.remaining() > self.margin
+        return self.remaining() - self.safety*nstep*self.time_per_step > self.margin
@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+
+import numpy as np
+
+from molmod.units import kelvin, atm
+from molmod.constants import boltzmann
+
+# Replica exchange (parallel tempering) of one structure in the (N,P,T)
+# ensemble.
+#
+# Every temperature is a replica with its own LAMMPS instance on a group of
+# MPI ranks (the ranks are split evenly over the replicas), running the
+# force field and integrator of md.py in remd/<struct>/<temp>K. Every
+# --exchange steps, swaps of neighbouring temperatures (alternating the even
+# and odd pairs) are attempted with the Metropolis criterion
+#   min(1, exp[(1/kT_i - 1/kT_j)(H_i - H_j)]),  H = U + PV,
+# and accepted swaps exchange the configurations (positions, cell, velocities
+# and barostat velocity, rescaled by sqrt(T_new/T_old)), such that every
+# folder keeps the trajectory of a single temperature. The thermostat chains
+# stay with their temperature.
+#
+# Every attempt is written to remd/<struct>/exchange.jsonl, and the
+# acceptance rate per pair is reported in remd/<struct>/remd.log.
+#
+# Run from the MDrun folder with a multiple of the number of replicas as the
+# number of ranks, e.g.
+#   mpirun -np 4 python remd.py --struct ABCDEF_all --temps 77 293 400 500
+
+def load_md(src):
+    # md.py of the structure as a module (its main part is not executed)
+    sys.path.insert(0, os.path.abspath(src))
+    md = importlib.import_module('md')
+    sys.path.pop(0)
+    return md
+
+def get_state(verlet):
+    return {
+        'pos': verlet.pos.copy(),
+        'vel': verlet.vel.copy(),
+        'rvecs': verlet.ff.system.cell.rvecs.copy(),
+        'vel_press': verlet.npt.vel_press.copy(),
+    }
+
+def set_state(verlet, state, scale):
+    # Configuration of another replica, velocities rescaled to this temperature
+    verlet.ff.update_rvecs(state['rvecs'])
+    verlet.pos[:] = state['pos']
+    verlet.vel[:] = state['vel']*scale
+    verlet.npt.vel_press[:] = state['vel_press']*scale
+    verlet.reset_forces()
+    verlet.ekin = verlet._compute_ekin()
+
+def get_swaps(temps, energies, volumes, press, offset, rng):
+    # Metropolis criterion for the pairs (i, i+1), i = offset, offset+2, ...
+    # Returns the permutation (configuration of replica perm[i] goes to
+    # temperature i) and the attempts
+    perm = list(range(len(temps)))
+    attempts = []
+    for i in range(offset, len(temps) - 1, 2):
+        j = i + 1
+        delta = (1/(boltzmann*temps[i]) - 1/(boltzmann*temps[j]))* \
+                ((energies[i] + press*volumes[i]) - (energies[j] + press*volumes[j]))
+        accepted = bool(delta >= 0 or rng.uniform() < np.exp(delta))
+        if accepted:
+            perm[i], perm[j] = j, i
+        attempts.append((i, j, float(delta), accepted))
+    return perm, attempts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--struct', default = 'ABCDEF_all')
+    parser.add_argument('--temps', nargs = '+', type = float, default = [77.0, 293.0, 400.0, 500.0],
+            help = 'temperatures of the replicas in K (increasing)')
+    parser.add_argument('--steps', type = int, default = 300000,
+            help = 'number of MD steps (of 0.5 fs) per replica')
+    parser.add_argument('--exchange', type = int, default = 1000,
+            help = 'number of steps (of 0.5 fs) between two exchange attempts')
+    parser.add_argument('--respa', type = int, default = 1)
+    parser.add_argument('--layer-step', type = int, default = 20,
+            help = 'write layers.h5 every N steps of 0.5 fs (0 = off), see md.py')
+    parser.add_argument('--cache', default = 'tables')
+    parser.add_argument('--seed', type = int, default = 1912180624)
+    parser.add_argument('--folder', default = 'remd',
+            help = 'output folder, the replicas run in <folder>/<struct>/<temp>K')
+    parser.add_argument('--no-lammps', action = 'store_true',
+            help = 'Yaff force field (Ewald summation) instead of LAMMPS, for short test runs')
+    args = parser.parse_args()
+    if args.respa < 1 or 20 % args.respa != 0:
+        parser.error('--respa should divide 20, the steps of 0.5 fs between two frames (10 fs)')
+    if args.exchange % args.respa != 0 or args.layer_step % args.respa != 0:
+        parser.error('--exchange and --layer-step should be multiples of --respa')
+
+    from mpi4py import MPI
+    world = MPI.COMM_WORLD
+    nrep = len(args.temps)
+    if world.Get_size() % nrep != 0:
+        raise ValueError('The number of ranks ({}) should be a multiple of the number of replicas ({})'.format(
+                world.Get_size(), nrep))
+    replica = world.Get_rank()//(world.Get_size()//nrep)
+    temps = [temp*kelvin for temp in args.temps]
+    press = 1*atm
+
+    # Working folder and force field of this replica
+    src = os.path.join('293K', args.struct)
+    md = load_md(src)
+    md.setup_mpi(world.Split(replica, world.Get_rank()))
+    cache = md.TabulationCache(os.path.abspath(args.cache))
+    path = os.path.abspath(os.path.join(args.folder, args.struct))
+    folder = os.path.join(path, '{:g}K'.format(args.temps[replica]))
+    if md.rank == 0:
+        os.makedirs(folder, exist_ok = True)
+    world.Barrier()
+    fn_pars = os.path.abspath(os.path.join(src, 'pars.txt'))
+    system = md.System.from_file(os.path.join(src, 'init.chk'))
+    os.chdir(folder)
+    if md.rank == 0:
+        # Output of this replica in its own md.log
+        sys.stdout.flush()
+        with open('md.log', 'a') as f:
+            os.dup2(f.fileno(), 1)
+    ff = md.load_ff(system, fn_pars, use_lammps = not args.no_lammps, cache = cache)
+    # The exchanges swap the barostat velocity of NPTVerletIntegrator
+    verlet = md.load_integrator(ff, temp = temps[replica], npt = 'virial', respa = args.respa,
+            layer_step = args.layer_step)
+
+    # Exchange attempts
+    leader = world.Get_rank() == 0
+    rng = np.random.RandomState(args.seed)
+    nattempt = np.zeros(nrep - 1, int)
+    naccept = np.zeros(nrep - 1, int)
+    configs = list(range(nrep)) # Initial configuration now at every temperature
+    if leader:
+        f_exchange = open(os.path.join(path, 'exchange.jsonl'), 'a')
+        f_log = open(os.path.join(path, 'remd.log'), 'a')
+    nsteps = args.steps//args.respa
+    nexchange = max(1, args.exchange//args.respa)
+    t0 = time.time()
+    for cycle in range(nsteps//nexchange):
+        verlet.run(nexchange)
+        info = world.allgather((replica, verlet.epot, verlet.ff.system.cell.volume) if md.rank == 0 else None)
+        info = sorted(item for item in info if item is not None)
+        perm, attempts = None, None
+        if leader:
+            perm, attempts = get_swaps(temps, [item[1] for item in info], [item[2] for item in info],
+                    press, cycle % 2, rng)
+        perm = world.bcast(perm, root = 0)
+        configs = [configs[i] for i in perm]
+        if perm != list(range(nrep)):
+            states = world.allgather(get_state(verlet) if md.rank == 0 else None)
+            states = [state for state in states if state is not None]
+            if perm[replica] != replica:
+                scale = np.sqrt(temps[replica]/temps[perm[replica]])
+                set_state(verlet, states[perm[replica]], scale)
+        if leader:
+            for i, j, delta, accepted in attempts:
+                nattempt[i] += 1
+                naccept[i] += accepted
+                f_exchange.write(json.dumps({'step': (cycle + 1)*nexchange*args.respa, 'pair': [args.temps[i], args.temps[j]],
+                        'delta': delta, 'accepted': accepted, 'configs': configs}) + '\n')
+            f_exchange.flush()
+            f_log.write('REMD step = {} acceptance = {}\n'.format((cycle + 1)*nexchange*args.respa, ' '.join(
+                    '{:g}-{:g}K: {}/{}'.format(args.temps[i], args.temps[i+1], naccept[i], nattempt[i]) for i in range(nrep - 1))))
+            f_log.flush()
+    walltime = time.time() - t0
+    if leader:
+        for i in range(nrep - 1):
+            f_log.write('REMD pair {:g}-{:g}K attempts = {} accepted = {} rate = {:.3f}\n'.format(
+                    args.temps[i], args.temps[i+1], nattempt[i], naccept[i], naccept[i]/max(1, nattempt[i])))
+        f_log.write('REMD replicas = {} ranks = {} walltime = {:.1f} s\n'.format(nrep, world.Get_size(), walltime))
+        f_log.close()
+        f_exchange.close()
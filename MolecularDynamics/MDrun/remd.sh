@@ -0,0 +1,20 @@
+#!/bin/sh
+#
+#PBS -N _md_remd
+#PBS -l walltime=72:00:00
+#PBS -l nodes=1:ppn=4
+#PBS -m n
+
+date
+
+# Run from the MDrun folder, e.g. qsub -v STRUCT=ABCDEF_all remd.sh
+cd $PBS_O_WORKDIR
+NPROCS=$(cat $PBS_NODEFILE | wc -l)
+
+# Load modules
+module load LAMMPS/3Mar2020-foss-2019b-Python-3.7.4-kokkos # Load LAMMPS, also loads yaff
+
+# Run, the ranks are split evenly over the four temperatures
+mpirun -np $NPROCS python remd.py --struct ${STRUCT:-ABCDEF_all} --temps 77 293 400 500
+
+date
@@ -1,9 +1,11 @@
+import os
+import sys
+import argparse
 import numpy as np
 
 from yaff import System, CVCOMProjection, log
 from yaff.pes.ff import ForceField
 from yaff.sampling.dof import StrainCellDOF
-from yaff.sampling.opt import CGOptimizer
 from yaff.pes.ext import Cell
 #log.set_level(0)
 from molmod import MolecularGraph
@@ -11,17 +13,33 @@ from molmod import MolecularGraph
 from molmod.units import angstrom, kjmol
 #from molmod.constants import boltzmann
 
+sys.path.insert(0, '../../StructureGeneration/Optimization')
+from opttools.optimizers import get_optimizer, optimizers
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--optimizer', choices = optimizers, default = 'cg',
+        help = 'optimizer of the two-layer systems (see StructureGeneration/Optimization/opttools/optimizers.py)')
+args = parser.parse_args()
+
 # Step 1: create 2layer system
 
 for struct in ['ABCDEF_all', 'ABCDEF_none']:
     system = System.from_file('../../MolecularDynamics/MDanalysis/calculations/0K/{}/frame0/frame0.chk'.format(struct))
-    graph = MolecularGraph(system.bonds, system.numbers)
-    indices = graph.independent_vertices
-    z_orders = {}
-    for index in indices:
-        zs = [system.pos[i][2] for i in index]
-        z_orders[tuple(index)] = np.mean(zs)
-    sorted_indices = [np.array(list(i)) for i in sorted(z_orders.keys(), key = lambda x: z_orders[x])]
+    fn_topology = '../../StructureGeneration/InitialStructure/output/{}.topology.npz'.format(struct)
+    if os.path.exists(fn_topology):
+        # Layers of the topology index written by create_init.py
+        atom_layer = np.load(fn_topology)['atom_layer']
+        assert len(atom_layer) == system.natom
+        order = np.argsort(atom_layer, kind = 'stable')
+        sorted_indices = np.split(order, np.cumsum(np.bincount(atom_layer))[:-1])
+    else:
+        graph = MolecularGraph(system.bonds, system.numbers)
+        indices = graph.independent_vertices
+        z_orders = {}
+        for index in indices:
+            zs = [system.pos[i][2] for i in index]
+            z_orders[tuple(index)] = np.mean(zs)
+        sorted_indices = [np.array(list(i)) for i in sorted(z_orders.keys(), key = lambda x: z_orders[x])]
     
     if struct == 'ABCDEF_all':
         subsys = system.subsystem(np.concatenate([sorted_indices[1], sorted_indices[2]]))
@@ -42,7 +60,7 @@ for struct in ['ABCDEF_all', 'ABCDEF_none']:
     }
     ff = ForceField.generate(subsys, pars, **ff_kwargs)
     dof = StrainCellDOF(ff)
-    opt = CGOptimizer(dof)
+    opt = get_optimizer(args.optimizer, dof, pars)
     while True:
         opt.run(100000)
         if opt.dof.converged:
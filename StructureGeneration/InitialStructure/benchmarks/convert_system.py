@@ -0,0 +1,41 @@
+import time
+import argparse
+
+import numpy as np
+
+from create_init import get_abcdef, convert_system
+
+# Time the generation (get_abcdef) and convert_system for lateral supercells
+# of the ABCDEF structure. The lateral repetitions of the 3456 atom cell give
+# 10^5 atoms and more (6x6: 124416), with a random half of the TP units
+# converted to TFB. The time per atom should stay constant.
+#
+# Run from the InitialStructure folder, e.g.
+#   PYTHONPATH=. python benchmarks/convert_system.py --reps 1 2 4 6
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reps', nargs = '+', type = int, default = [1, 2, 4, 6],
+            help = 'lateral repetitions of the ABCDEF cell')
+    parser.add_argument('--fraction', type = float, default = 0.5,
+            help = 'fraction of the TP units converted to TFB')
+    parser.add_argument('--repeat', type = int, default = 3)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(1912180624)
+    print('{:>6s} {:>8s} {:>6s} {:>12s} {:>10s} {:>12s}'.format('reps', 'natom', 'ntfb', 'generate [s]',
+            'time [s]', 'us/atom'))
+    for reps in args.reps:
+        t0 = time.time()
+        system = get_abcdef(nx = 2*reps, ny = 2*reps)
+        generate = time.time() - t0
+        ntp = 2*(system.natom//72)
+        indices = rng.choice(ntp, size = int(args.fraction*ntp), replace = False)
+        timings = []
+        for i in range(args.repeat):
+            t0 = time.time()
+            convert_system(system, indices)
+            timings.append(time.time() - t0)
+        elapsed = min(timings)
+        print('{:>6s} {:8d} {:6d} {:12.3f} {:10.3f} {:12.3f}'.format('{}x{}'.format(reps, reps), system.natom,
+                len(indices), generate, elapsed, 1e6*elapsed/system.natom))
@@ -0,0 +1,112 @@
+import numpy as np
+
+from yaff import System
+
+from create_init import get_ffatype_table, get_system, get_topology
+
+# All generated structures in a single HDF5 file.
+#
+# Every structure is the same parent structure (the ABCDEF stacking of TP
+# units of get_abcdef) with some TP units converted to TFB. The parent is
+# stored once, and every structure only as its differences with the parent:
+#   parent/system       numbers, pos, ffatypes, ffatype_ids, bonds, rvecs
+#   parent/topology     atom_layer, atom_sbu, atom_linker, sbu_layer,
+#                       linker_sbus (see get_topology in create_init.py)
+#   ffatypes            ffatype table of all structures
+#   structures/<name>/  tfb               indices of the TFB units
+#                       deleted           atoms that are removed
+#                       changed           atoms with another ffatype or number
+#                       ffatype_ids       their ffatype ids (in ffatypes)
+#                       numbers           their atomic numbers
+# Bundle loads a single structure on request, identical to convert_system.
+
+parent_topology = ['atom_layer', 'atom_sbu', 'atom_linker', 'sbu_layer', 'linker_sbus']
+
+class BundleWriter(object):
+    def __init__(self, f, parent, nlayer = 12):
+        self.f = f
+        self.parent = parent
+        sgrp = f.create_group('parent/system')
+        sgrp['numbers'] = parent.numbers
+        sgrp['pos'] = parent.pos
+        sgrp['ffatypes'] = np.array(parent.ffatypes, 'S')
+        sgrp['ffatype_ids'] = parent.ffatype_ids
+        sgrp['bonds'] = parent.bonds
+        sgrp['rvecs'] = parent.cell.rvecs
+        topology = get_topology(parent, [], nlayer = nlayer)
+        for key in parent_topology:
+            f['parent/topology/{}'.format(key)] = topology[key]
+        self.names = get_ffatype_table(parent)
+        f['ffatypes'] = np.array(self.names, 'S')
+
+    def add(self, name, indices, names, ffatype_ids, numbers, keep):
+        # Structure with the TFB units in indices and the arrays of
+        # convert_arrays(parent, indices)
+        if list(names) != self.names:
+            raise ValueError('The ffatype table of {} differs from the one of the bundle'.format(name))
+        changed = np.where((ffatype_ids != self.parent.ffatype_ids) | (numbers != self.parent.numbers))[0]
+        grp = self.f.create_group('structures/{}'.format(name))
+        grp['tfb'] = np.array(indices, np.int32)
+        grp['deleted'] = np.where(~keep)[0].astype(np.int32)
+        grp['changed'] = changed.astype(np.int32)
+        grp['ffatype_ids'] = ffatype_ids[changed].astype(np.int16)
+        grp['numbers'] = numbers[changed].astype(np.int8)
+
+class Bundle(object):
+    def __init__(self, f):
+        self.f = f
+        self.parent = None
+
+    def __len__(self):
+        return len(self.f['structures'])
+
+    def __contains__(self, name):
+        return name in self.f['structures']
+
+    def __getitem__(self, name):
+        return self.get_system(name)
+
+    def get_names(self):
+        return list(self.f['structures'])
+
+    def get_parent(self):
+        # The parent structure is only read once
+        if self.parent is None:
+            sgrp = self.f['parent/system']
+            self.parent = System(numbers = sgrp['numbers'][:], pos = sgrp['pos'][:],
+                    ffatypes = [ffatype.decode() for ffatype in sgrp['ffatypes'][:]],
+                    ffatype_ids = sgrp['ffatype_ids'][:], bonds = sgrp['bonds'][:], rvecs = sgrp['rvecs'][:])
+            self.names = [ffatype.decode() for ffatype in self.f['ffatypes'][:]]
+        return self.parent
+
+    def get_arrays(self, name):
+        # Arrays of convert_arrays for one structure
+        parent = self.get_parent()
+        grp = self.f['structures/{}'.format(name)]
+        changed = grp['changed'][:]
+        ffatype_ids = parent.ffatype_ids.copy()
+        ffatype_ids[changed] = grp['ffatype_ids'][:]
+        numbers = parent.numbers.copy()
+        numbers[changed] = grp['numbers'][:]
+        keep = np.ones(parent.natom, bool)
+        keep[grp['deleted'][:]] = False
+        return self.names, ffatype_ids, numbers, keep
+
+    def get_system(self, name):
+        return get_system(self.get_parent(), *self.get_arrays(name))
+
+    def get_topology(self, name):
+        # Topology index of one structure, as get_topology in create_init.py
+        parent = self.get_parent()
+        grp = self.f['structures/{}'.format(name)]
+        keep = np.ones(parent.natom, bool)
+        keep[grp['deleted'][:]] = False
+        topology = dict((key, self.f['parent/topology/{}'.format(key)][:]) for key in parent_topology)
+        for key in ['atom_layer', 'atom_sbu', 'atom_linker']:
+            topology[key] = topology[key][keep]
+        sbu_type = np.zeros(len(topology['sbu_layer']), np.int8)
+        sbu_type[grp['tfb'][:]] = 1
+        linker_sbus = topology['linker_sbus']
+        topology['sbu_type'] = sbu_type
+        topology['linker_type'] = (2*sbu_type[linker_sbus[:, 0]] + sbu_type[linker_sbus[:, 1]]).astype(np.int8)
+        return topology
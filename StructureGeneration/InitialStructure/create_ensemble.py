@@ -0,0 +1,175 @@
+import time
+import argparse
+import multiprocessing
+
+import numpy as np
+import h5py as h5
+
+from create_init import get_abcdef, convert_arrays, natom_cell, tfb_counts
+from bundle import BundleWriter, Bundle
+from patterns import PatternIndex
+from sro import get_shells, sample_pattern
+
+# Several random realisations of the TP/TFB substitution per composition.
+#
+# create_init.py generates a single realisation per number of TFB units. Here,
+# K realisations of every composition are generated by a pool of worker
+# processes: every worker samples the substitution pattern of a realisation
+# and converts the structure. Realisation k of the composition with n TFB
+# units uses the seed SeedSequence([seed, n, k]). All structures are written to a single HDF5 bundle
+# (the parent structure once and every structure as its differences with it,
+# see bundle.py), with an index:
+#   index/names         names of the structures, e.g. ABCDEF_full10_003
+#   index/ntfb          number of TFB units
+#   index/realisation   realisation k of the composition
+#   index/seed          seed of the substitution pattern
+#   index/patterns      (nstruct, nsbu) 1 for the SBUs that are TFB
+# The pure TP and TFB structures have a single realisation. Patterns that are
+# equivalent by symmetry to an earlier realisation (see patterns.py) are
+# skipped, and the realisation gets the next seed SeedSequence([seed, n, k, a])
+# for attempt a = 1, 2, ... The parent process screens the patterns in the
+# order of the realisations, so the result does not depend on the number of
+# workers. The attempt of realisation k does depend on the patterns of the
+# realisations before it, so index/seed (and not n and k) is what reproduces a
+# single realisation.
+#
+# With --sro, the patterns are sampled with a target Warren-Cowley short-range
+# order (in-plane and interlayer, see sro.py) instead of uniformly, and the
+# index gets the reached values in index/alpha. Patterns that did not reach
+# the target within the tolerance are reported with a warning and have
+# index/converged False.
+#
+# Run from the InitialStructure folder, e.g.
+#   python create_ensemble.py --realisations 8 --workers 8 --out output/ensemble.h5
+
+def get_seed(seed, ntfb, realisation, attempt = 0):
+    entropy = [seed, ntfb, realisation] + ([attempt] if attempt > 0 else [])
+    return int(np.random.SeedSequence(entropy).generate_state(1)[0])
+
+def get_pattern(ntp, ntfb, seed, sro = None):
+    # Indices of the TP units that are converted to TFB, and the short-range
+    # order and whether it reached the target if sro = (shells, target) is
+    # given
+    rng = np.random.RandomState(seed)
+    if sro is None:
+        return rng.choice(ntp, size = ntfb, replace = False), None, True
+    shells, target = sro
+    return sample_pattern(shells, ntp, ntfb, target, rng)
+
+abcdef = None
+ntp = None
+sro = None
+
+def init_worker(nx, ny, nlayer, target = None):
+    # Every worker generates the unconverted structure (and its SBU pairs for
+    # the short-range order) once
+    global abcdef, ntp, sro
+    abcdef = get_abcdef(nx = nx, ny = ny, nlayer = nlayer)
+    ntp = 2*(abcdef.natom//natom_cell)
+    if target is not None:
+        sro = (get_shells(abcdef), target)
+
+def generate(task):
+    # Pattern and converted structure of task = (ntfb, realisation, seed),
+    # with seed None for the pure structures
+    ntfb, realisation, seed = task
+    if seed is None:
+        indices, alpha, converged = np.arange(ntfb), None, True
+    else:
+        indices, alpha, converged = get_pattern(ntp, ntfb, seed, sro = sro)
+    return task, indices, alpha, converged, convert_arrays(abcdef, indices)
+
+def retry(pool, ntfb, realisation, seed, index, max_attempt = 1000, batch = 1):
+    # First result of the attempts 1, 2, ... of a realisation with a pattern
+    # that is new in index, None if all attempts are duplicates. The attempts
+    # are generated by the pool, batch of them at a time.
+    for start in range(1, max_attempt, batch):
+        tasks = [(ntfb, realisation, get_seed(seed, ntfb, realisation, attempt))
+                for attempt in range(start, min(start + batch, max_attempt))]
+        for result in pool.map(generate, tasks):
+            if index.add(result[1]):
+                return result
+    return None
+
+def iter_structures(pool, ntp, nrealisation, seed, name = 'ABCDEF', index = None, max_attempt = 1000, batch = 1):
+    # (name, result of generate) of every structure, with patterns that are new
+    # in index (a PatternIndex, None to keep duplicates). The pool generates
+    # the first attempt of all realisations, and the results are screened in
+    # the order of the realisations, so the outcome does not depend on the
+    # number of workers.
+    tasks = [(int(round(count*ntp/96.0)), k) for count in tfb_counts for k in range(nrealisation)]
+    tasks = [(ntfb, k, get_seed(seed, ntfb, k)) for ntfb, k in tasks]
+    exhausted = set()
+    for result in pool.imap(generate, tasks):
+        ntfb, k, _ = result[0]
+        if ntfb in exhausted:
+            continue
+        if index is not None and not index.add(result[1]):
+            result = retry(pool, ntfb, k, seed, index, max_attempt = max_attempt, batch = batch)
+            if result is None:
+                # All distinct patterns of this composition are done
+                exhausted.add(ntfb)
+                continue
+        yield '{}_full{}_{:03d}'.format(name, ntfb, k), result
+    for label, result in zip(['all', 'none'], pool.map(generate, [(ntp, 0, None), (0, 0, None)])):
+        yield '{}_{}_000'.format(name, label), result
+
+def load_structure(f, name):
+    # System of one structure of the HDF5 file
+    return Bundle(f).get_system(name)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--realisations', type = int, default = 8,
+            help = 'number of realisations K of every mixed composition')
+    parser.add_argument('--workers', type = int, default = multiprocessing.cpu_count())
+    parser.add_argument('--seed', type = int, default = 1912180624)
+    parser.add_argument('--reps', nargs = 2, type = int, default = [2, 2])
+    parser.add_argument('--layers', type = int, default = 12)
+    parser.add_argument('--out', default = 'output/ensemble.h5')
+    parser.add_argument('--sro', nargs = 2, type = float, default = None,
+            help = 'target Warren-Cowley parameters (in-plane, interlayer) of the patterns')
+    parser.add_argument('--keep-duplicates', action = 'store_true',
+            help = 'do not skip patterns that are equivalent by symmetry')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    nx, ny = args.reps
+    ntp = 2*nx*ny*args.layers
+    prefix = 'ABCDEF'
+    if (nx, ny, args.layers) != (2, 2, 12):
+        prefix = 'ABCDEF_{}x{}x{}'.format(nx, ny, args.layers)
+    index = None if args.keep_duplicates else PatternIndex(nx, ny, args.layers)
+    pool = multiprocessing.Pool(args.workers, initializer = init_worker,
+            initargs = (nx, ny, args.layers, args.sro))
+    names, tasks, patterns, alphas, converged = [], [], [], [], []
+    with h5.File(args.out, 'w') as f:
+        writer = BundleWriter(f, get_abcdef(nx = nx, ny = ny, nlayer = args.layers), nlayer = args.layers)
+        f.attrs['reps'] = [nx, ny]
+        f.attrs['layers'] = args.layers
+        f.attrs['seed'] = args.seed
+        for name, (task, indices, alpha, reached, arrays) in iter_structures(pool, ntp, args.realisations,
+                args.seed, name = prefix, index = index, batch = args.workers):
+            writer.add(name, indices, *arrays)
+            names.append(name)
+            tasks.append(task)
+            pattern = np.zeros(ntp, np.uint8)
+            pattern[indices] = 1
+            patterns.append(pattern)
+            alphas.append(np.full(2, np.nan) if alpha is None else alpha)
+            converged.append(reached)
+            print('{} ({}): seed = {}'.format(name, task[0], task[2] or 0))
+            if not reached:
+                print('WARNING {}: alpha = {:.3f} {:.3f} did not reach the target {:.3f} {:.3f}'.format(
+                    name, alpha[0], alpha[1], *args.sro))
+        f['index/names'] = np.array(names, 'S')
+        f['index/ntfb'] = np.array([task[0] for task in tasks])
+        f['index/realisation'] = np.array([task[1] for task in tasks])
+        f['index/seed'] = np.array([task[2] or 0 for task in tasks], np.int64)
+        f['index/patterns'] = np.array(patterns)
+        if args.sro is not None:
+            f['index/alpha'] = np.array(alphas)
+            f['index/converged'] = np.array(converged)
+    pool.close()
+    pool.join()
+    print('ENSEMBLE structures = {} workers = {} t = {:.1f} s'.format(len(names), args.workers, time.time() - t0))
@@ -1,4 +1,5 @@
 import os
+import argparse
 
 import numpy as np
 np.random.seed(1912180624)
@@ -6,214 +7,256 @@ np.random.seed(1912180624)
 from yaff import System
 from molmod.units import angstrom, deg
 
-def get_indices(n):
-    high = 96
+def get_indices(n, high = 96):
     for i in np.random.choice(high, size = n, replace = False):
         yield i
 
-sys = System.from_file('PA_TP.chk') # Unphysical interlayer distance of 10A
-rvecs = sys.cell.rvecs.copy()
-rvecs[2][2] = 3.0*angstrom
-sys.cell.update_rvecs(rvecs)
-assert sys.natom == 72
-sys = sys.supercell(2,2,1)
-
-# Create system with six different offsets
-sys6 = sys.supercell(1,1,6)
-d = np.array([0.0, 0.0, 0.0])
-for i in range(6):
-    sys6.pos[i*288:(i+1)*288:] += d
-    angle = (30+i*60)*deg
-    d += np.array([np.cos(angle), np.sin(angle), 0.0])*2.5*angstrom
-
-# System 1: ABCD.. inclination
-rvecs = sys.cell.rvecs.copy()
-rvecs[2] = np.array([0.0, 2.5*angstrom, 3.0*angstrom])
-sys.cell.update_rvecs(rvecs)
-abcdef = sys6.supercell(1,1,2) # ABCDEF inclination
+def get_abcdef(fn = 'PA_TP.chk', nx = 2, ny = 2, nlayer = 12):
+    sys = System.from_file(fn) # Unphysical interlayer distance of 10A
+    rvecs = sys.cell.rvecs.copy()
+    rvecs[2][2] = 3.0*angstrom
+    sys.cell.update_rvecs(rvecs)
+    assert sys.natom == 72
+    sys = sys.supercell(nx,ny,1)
+    natom_layer = sys.natom
+
+    # Offsets of the six layers of the ABCDEF stacking
+    offsets = [np.array([0.0, 0.0, 0.0])]
+    for i in range(5):
+        angle = (30+i*60)*deg
+        offsets.append(offsets[-1] + np.array([np.cos(angle), np.sin(angle), 0.0])*2.5*angstrom)
+
+    # Create system with nlayer layers, the offsets repeat every six layers
+    abcdef = sys.supercell(1,1,nlayer)
+    for i in range(nlayer):
+        abcdef.pos[i*natom_layer:(i+1)*natom_layer:] += offsets[i % 6]
+    if nlayer % 6 != 0:
+        # Incline c such that the stacking continues in the next cell
+        rvecs = abcdef.cell.rvecs.copy()
+        rvecs[2] += offsets[nlayer % 6]
+        abcdef.cell.update_rvecs(rvecs)
+    return abcdef
+
+# Number of TFB units of the mixed COFs with 96 SBUs
+tfb_counts = [10, 19, 29, 38, 48, 58, 67, 77, 86]
 
 # Convert TP to TFB
-def iter_todo():
+def iter_todo(ntp = 96):
     def indices(n):
         result = []
-        high = 96
-        for i in np.random.choice(high, size = n, replace = False):
+        for i in np.random.choice(ntp, size = n, replace = False):
             result.extend([x for x in indices_tp(i)])
         return result
     def indices_tp(n):
         yield n
     
-    # Mixed COFs
-    for i in [10, 19, 29, 38, 48, 58, 67, 77, 86]:
-        yield 'full{}'.format(i), indices(i)
+    # Mixed COFs, with the number of TFB units of the 96 SBU cell scaled to ntp
+    for i in tfb_counts:
+        n = int(round(i*ntp/96.0))
+        yield 'full{}'.format(n), indices(n)
     
     # TFB-PA COF
-    yield 'all', [i for i in range(96)]
+    yield 'all', [i for i in range(ntp)]
     # TP-PA COF
     yield 'none', []
 
-def convert_system(sys, indices):
-    def iter_tp(index):
-        if index % 2 == 0:
-            for i in range(15):
-                yield 72*(index//2) + i
-        elif index % 2 == 1:
-            for i in range(57, 72):
-                yield 72*(index//2) + i
-
-    def iter_pa(index):
-        if index % 3 == 0:
-            for i in range(15, 29):
-                yield 72*(index//3) + i
-        elif index % 3 == 1:
-            for i in range(29, 43):
-                yield 72*(index//3) + i
-        elif index % 3 == 2:
-            for i in range(43, 57):
-                yield 72*(index//3) + i
-
-    def get_neightype(i):
-        for j in sys.neighs1[i]:
-            if not ffatypes[j].endswith('PA11'):
-                return {'TP': 1, 'TPB': 2}[ffatypes[j].split('_')[-1]]
-
-    bonds = sys.bonds.copy()
-    pos = sys.pos.copy()
-    rvecs = sys.cell.rvecs.copy()
-    ffatypes = [sys.get_ffatype(i) for i in range(sys.natom)]
+# Conversion tables. A unit cell of PA_TP.chk (72 atoms) holds two TP units
+# (atoms 0-14 and 57-71) and three PA linkers (atoms 15-28, 29-42, 43-56), so
+# TP unit i and PA linker i of a supercell start at 72*(i//2) and 72*(i//3).
+natom_cell = 72
+tp_offsets = [np.arange(15), np.arange(57, 72)]
+pa_offsets = [np.arange(15, 29), np.arange(29, 43), np.arange(43, 57)]
+
+# Ffatype of every TP atom in a TFB unit, and the new atomic numbers
+tp_tfb = {
+    'C_C3_TP': 'C_C3_H3C2N_TPB',
+    'C_C2O_TP': 'C_HC2_C4_TPB',
+    'O_TP': 'H_C_C2_TPB',
+    'C_HCN_TP': 'C_HCN_C3_TPB',
+    'H_C_CN_TP': 'H_C_CN_TPB',
+}
+tp_tfb_numbers = {'O_TP': 1}
+
+# Ffatype of every atom of a PA linker (rows) given the units bonded to the
+# nitrogen atoms 10 and 11 (columns, 1 = TP, 2 = TFB: PA11, PA12, PA21, PA22).
+# Imine hydrogens that are removed are DEL.
+pa_targets = ['PA11', 'PA12', 'PA21', 'PA22']
+pa_ffatypes = [
+    ['C_C2N_0_PA11', 'C_C2N_H3C3_0_PA12', 'C_C2N_H2C3_PA12', 'C_C2N_PA22'],
+    ['C_C2N_0_PA11', 'C_C2N_H2C3_PA12', 'C_C2N_H3C3_0_PA12', 'C_C2N_PA22'],
+    ['C_HC2_HC2N_0_PA11', 'C_HC2_HC2N_1_PA12', 'C_HC2_HC2N_0_PA12', 'C_HC2_PA22'],
+    ['C_HC2_HC2N_0_PA11', 'C_HC2_HC2N_0_PA12', 'C_HC2_HC2N_1_PA12', 'C_HC2_PA22'],
+    ['C_HC2_HC2N_0_PA11', 'C_HC2_HC2N_0_PA12', 'C_HC2_HC2N_1_PA12', 'C_HC2_PA22'],
+    ['C_HC2_HC2N_0_PA11', 'C_HC2_HC2N_1_PA12', 'C_HC2_HC2N_0_PA12', 'C_HC2_PA22'],
+    ['H_C_C2_0_PA11', 'H_C_C2_1_PA12', 'H_C_C2_0_PA12', 'H_C_PA22'],
+    ['H_C_C2_0_PA11', 'H_C_C2_0_PA12', 'H_C_C2_1_PA12', 'H_C_PA22'],
+    ['H_C_C2_0_PA11', 'H_C_C2_0_PA12', 'H_C_C2_1_PA12', 'H_C_PA22'],
+    ['H_C_C2_0_PA11', 'H_C_C2_1_PA12', 'H_C_C2_0_PA12', 'H_C_PA22'],
+    ['N_0_PA11', 'N_HC2_0_PA12', 'N_C2_PA12', 'N_C2_PA22'],
+    ['N_0_PA11', 'N_C2_PA12', 'N_HC2_0_PA12', 'N_C2_PA22'],
+    ['H_N_0_PA11', 'DEL', 'H_N_0_PA12', 'DEL'],
+    ['H_N_0_PA11', 'H_N_0_PA12', 'DEL', 'DEL'],
+]
+
+def get_unit_atoms(nunit, offsets):
+    # Atom indices (nunit, natom per unit) of all TP units or PA linkers
+    units = np.arange(nunit)
+    offsets = np.array(offsets)
+    return natom_cell*(units//len(offsets)).reshape(-1, 1) + offsets[units % len(offsets)]
+
+def get_linker_units(sys):
+    # TP units (npa, 2) bonded to the nitrogen atoms 10 and 11 of every PA
+    # linker, i.e. the pairs of neighbouring SBUs in a layer
+    ncell = sys.natom//natom_cell
+    tp_atoms = get_unit_atoms(2*ncell, tp_offsets)
+    pa_atoms = get_unit_atoms(3*ncell, pa_offsets)
+    unit = np.full(sys.natom, -1)
+    unit[tp_atoms] = np.arange(len(tp_atoms)).reshape(-1, 1)
+    is_pa = np.zeros(sys.natom, bool)
+    is_pa[pa_atoms] = True
+    neighbour = np.full(sys.natom, -1)
+    for i0, i1 in [(0, 1), (1, 0)]:
+        link = is_pa[sys.bonds[:, i0]] & ~is_pa[sys.bonds[:, i1]]
+        neighbour[sys.bonds[link, i0]] = sys.bonds[link, i1]
+    units = unit[neighbour[pa_atoms[:, 10:12]]]
+    assert (neighbour[pa_atoms[:, 10:12]] >= 0).all() and (units >= 0).all()
+    return units
+
+def convert_arrays(sys, indices):
+    # Convert the TP units in indices to TFB, relabel the PA linkers according
+    # to their neighbours and mark the imine hydrogens of the TFB side for
+    # removal, all with index arrays and lookup tables. Returns the ffatype
+    # table, the ffatype ids and numbers of all atoms of sys and a mask of the
+    # atoms to keep.
+    ncell = sys.natom//natom_cell
+    assert sys.natom == ncell*natom_cell
+    tp_atoms = get_unit_atoms(2*ncell, tp_offsets)
+    pa_atoms = get_unit_atoms(3*ncell, pa_offsets)
+
+    # Ffatype table with all new ffatypes, and lookup tables of the ids
+    names = get_ffatype_table(sys)
+    ids = {name: i for i, name in enumerate(names)}
+    tfb_ids = np.full(len(names), -1)
+    tfb_numbers = np.zeros(len(names), int)
+    for name, new in tp_tfb.items():
+        if name in ids:
+            tfb_ids[ids[name]] = ids[new]
+            tfb_numbers[ids[name]] = tp_tfb_numbers.get(name, 0)
+    pa_ids = np.array([[ids[name] for name in row] for row in pa_ffatypes])
+
+    ffatype_ids = sys.ffatype_ids.copy()
     numbers = sys.numbers.copy()
     # Convert TP to TFB
-    for index in indices:
-        for count, i in enumerate(iter_tp(index)):
-            ffatype = ffatypes[i]
-            assert ffatype.endswith('_TP')
-            if ffatype == 'C_C3_TP':
-                ffatypes[i] = 'C_C3_H3C2N_TPB'
-            elif ffatype == 'C_C2O_TP':
-                ffatypes[i] = 'C_HC2_C4_TPB'
-            elif ffatype == 'O_TP':
-                numbers[i] = 1
-                ffatypes[i] = 'H_C_C2_TPB'
-            elif ffatype == 'C_HCN_TP':
-                ffatypes[i] = 'C_HCN_C3_TPB'
-            elif ffatype == 'H_C_CN_TP':
-                ffatypes[i] = 'H_C_CN_TPB'
-            else:
-                raise RuntimeError('Did not expect ffatype ' + ffatype)
-            assert not ffatypes[i] == ffatype
-
-    # Update PA11
-    for index in range(144):
-        new_indices = {}
-        for count, i in enumerate(iter_pa(index)):
-            new_indices[count] = i
-        target = 'PA{}{}'.format(get_neightype(new_indices[10]), get_neightype(new_indices[11]))
-        for count, i in new_indices.items():
-            ffatypes[i] = {
-                    0: {
-                        'PA11': 'C_C2N_0_PA11',
-                        'PA12': 'C_C2N_H3C3_0_PA12',
-                        'PA21': 'C_C2N_H2C3_PA12',
-                        'PA22': 'C_C2N_PA22'
-                        },
-                    1: {
-                        'PA11': 'C_C2N_0_PA11',
-                        'PA12': 'C_C2N_H2C3_PA12',
-                        'PA21': 'C_C2N_H3C3_0_PA12',
-                        'PA22': 'C_C2N_PA22'
-                        },
-                    2: {
-                        'PA11': 'C_HC2_HC2N_0_PA11',
-                        'PA12': 'C_HC2_HC2N_1_PA12',
-                        'PA21': 'C_HC2_HC2N_0_PA12',
-                        'PA22': 'C_HC2_PA22'
-                        },
-                    3: {
-                        'PA11': 'C_HC2_HC2N_0_PA11',
-                        'PA12': 'C_HC2_HC2N_0_PA12',
-                        'PA21': 'C_HC2_HC2N_1_PA12',
-                        'PA22': 'C_HC2_PA22'
-                        },
-                    4: {
-                        'PA11': 'C_HC2_HC2N_0_PA11',
-                        'PA12': 'C_HC2_HC2N_0_PA12',
-                        'PA21': 'C_HC2_HC2N_1_PA12',
-                        'PA22': 'C_HC2_PA22'
-                        },
-                    5: {
-                        'PA11': 'C_HC2_HC2N_0_PA11',
-                        'PA12': 'C_HC2_HC2N_1_PA12',
-                        'PA21': 'C_HC2_HC2N_0_PA12',
-                        'PA22': 'C_HC2_PA22'
-                        },
-                    6: {
-                        'PA11': 'H_C_C2_0_PA11',
-                        'PA12': 'H_C_C2_1_PA12',
-                        'PA21': 'H_C_C2_0_PA12',
-                        'PA22': 'H_C_PA22'
-                        },
-                    7: {
-                        'PA11': 'H_C_C2_0_PA11',
-                        'PA12': 'H_C_C2_0_PA12',
-                        'PA21': 'H_C_C2_1_PA12',
-                        'PA22': 'H_C_PA22'
-                        },
-                    8: {
-                        'PA11': 'H_C_C2_0_PA11',
-                        'PA12': 'H_C_C2_0_PA12',
-                        'PA21': 'H_C_C2_1_PA12',
-                        'PA22': 'H_C_PA22'
-                        },
-                    9: {
-                        'PA11': 'H_C_C2_0_PA11',
-                        'PA12': 'H_C_C2_1_PA12',
-                        'PA21': 'H_C_C2_0_PA12',
-                        'PA22': 'H_C_PA22'
-                        },
-                    10: {
-                        'PA11': 'N_0_PA11',
-                        'PA12': 'N_HC2_0_PA12',
-                        'PA21': 'N_C2_PA12',
-                        'PA22': 'N_C2_PA22'
-                        },
-                    11: {
-                        'PA11': 'N_0_PA11',
-                        'PA12': 'N_C2_PA12',
-                        'PA21': 'N_HC2_0_PA12',
-                        'PA22': 'N_C2_PA22'
-                        },
-                    12: {
-                        'PA11': 'H_N_0_PA11',
-                        'PA12': 'DEL',
-                        'PA21': 'H_N_0_PA12',
-                        'PA22': 'DEL'
-                        },
-                    13: {
-                        'PA11': 'H_N_0_PA11',
-                        'PA12': 'H_N_0_PA12',
-                        'PA21': 'DEL',
-                        'PA22': 'DEL'
-                        }
-                    }[count][target]
-            if target == 'PA21':
-                assert ffatypes[i].split('_')[-1] in ['PA12', 'DEL']
-            else:
-                assert ffatypes[i].split('_')[-1] in [target, 'DEL']
-
-        
-    # Remove imine hydrogens assigned ffatype DEL
-    system_indices = [i for i in range(sys.natom) if not ffatypes[i] == 'DEL']
-    new_system = System(numbers = numbers, pos = pos, bonds = bonds, ffatypes = ffatypes, rvecs = rvecs)
-    return new_system.subsystem(system_indices)
-    
-for name, system in [('ABCDEF', abcdef)]:
-    for label, indices in iter_todo():
-        print('{}_{} ({}): {}'.format(name, label, len(indices), indices))
-        new_system = convert_system(system, indices)
-        folder = 'output'
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-        new_system.to_file('output/{}_{}.chk'.format(name, label))
+    atoms = tp_atoms[np.array(indices, int)].ravel()
+    old = ffatype_ids[atoms]
+    if (tfb_ids[old] < 0).any():
+        raise RuntimeError('Did not expect ffatypes ' + ', '.join(sorted(set(names[i] for i in old[tfb_ids[old] < 0]))))
+    ffatype_ids[atoms] = tfb_ids[old]
+    changed = tfb_numbers[old] > 0
+    numbers[atoms[changed]] = tfb_numbers[old][changed]
+
+    # Update PA11: type of the unit bonded to the nitrogen atoms 10 and 11
+    tfb = np.zeros(len(tp_atoms), int)
+    tfb[np.array(indices, int)] = 1
+    units = get_linker_units(sys)
+    target = 2*tfb[units[:, 0]] + tfb[units[:, 1]]
+    ffatype_ids[pa_atoms] = pa_ids.T[target]
+
+    # Imine hydrogens assigned ffatype DEL are removed
+    return names, ffatype_ids, numbers, ffatype_ids != ids['DEL']
+
+def get_ffatype_table(sys):
+    # Ffatypes of sys followed by all ffatypes of the conversion tables
+    names = list(sys.ffatypes)
+    for name in list(tp_tfb.values()) + [name for row in pa_ffatypes for name in row]:
+        if name not in names:
+            names.append(name)
+    return names
+
+def get_system(sys, names, ffatype_ids, numbers, keep):
+    # System with the atoms of sys in keep, the ffatypes in order of
+    # appearance (as System orders a list of ffatypes)
+    used, first = np.unique(ffatype_ids, return_index = True)
+    order = used[np.argsort(first)]
+    remap = np.zeros(len(names), int)
+    remap[order] = np.arange(len(order))
+    new_system = System(numbers = numbers, pos = sys.pos.copy(), bonds = sys.bonds.copy(),
+            ffatypes = [names[i] for i in order], ffatype_ids = remap[ffatype_ids], rvecs = sys.cell.rvecs.copy())
+    return new_system.subsystem(np.where(keep)[0])
+
+def convert_system(sys, indices):
+    return get_system(sys, *convert_arrays(sys, indices))
+
+def get_topology(sys, indices, nlayer = 12):
+    # Index arrays of the system of convert_system(sys, indices): layer (from
+    # bottom to top), SBU and PA linker of every atom (-1 if none), the type
+    # of every SBU (0 = TP, 1 = TFB) and of every PA linker (0-3 = PA11, PA12,
+    # PA21, PA22), the layer of every SBU and the SBUs of every PA linker
+    ncell = sys.natom//natom_cell
+    tp_atoms = get_unit_atoms(2*ncell, tp_offsets)
+    pa_atoms = get_unit_atoms(3*ncell, pa_offsets)
+    sbu_type = np.zeros(len(tp_atoms), int)
+    sbu_type[np.array(indices, int)] = 1
+    linker_sbus = get_linker_units(sys)
+    linker_type = 2*sbu_type[linker_sbus[:, 0]] + sbu_type[linker_sbus[:, 1]]
+    atom_sbu = np.full(sys.natom, -1)
+    atom_sbu[tp_atoms] = np.arange(len(tp_atoms)).reshape(-1, 1)
+    atom_linker = np.full(sys.natom, -1)
+    atom_linker[pa_atoms] = np.arange(len(pa_atoms)).reshape(-1, 1)
+    atom_layer = (np.arange(sys.natom)//natom_cell)//(ncell//nlayer)
+    # Imine hydrogens that convert_system removes
+    deleted = np.zeros(sys.natom, bool)
+    deleted[pa_atoms] = np.array([[name == 'DEL' for name in row] for row in pa_ffatypes]).T[linker_type]
+    return {
+        'atom_layer': atom_layer[~deleted].astype(np.int32),
+        'atom_sbu': atom_sbu[~deleted].astype(np.int32),
+        'atom_linker': atom_linker[~deleted].astype(np.int32),
+        'sbu_type': sbu_type.astype(np.int8),
+        'sbu_layer': ((np.arange(len(tp_atoms))//2)//(ncell//nlayer)).astype(np.int32),
+        'linker_type': linker_type.astype(np.int8),
+        'linker_sbus': linker_sbus.astype(np.int32),
+    }
+
+def get_fn_topology(fn_chk):
+    # Topology index stored next to a .chk file
+    return fn_chk[:-len('.chk')] + '.topology.npz'
 
-        
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reps', nargs = 2, type = int, default = [2, 2],
+            help = 'lateral repetitions of the PA_TP.chk cell (2 SBUs per cell and layer)')
+    parser.add_argument('--layers', type = int, default = 12,
+            help = 'number of layers (ABCDEF stacking)')
+    parser.add_argument('--bundle', default = None,
+            help = 'also write all structures to this HDF5 bundle (see bundle.py)')
+    args = parser.parse_args()
+    if args.bundle is not None:
+        # Imported before any pattern is drawn, as bundle.py imports this module
+        # (and so seeds numpy again)
+        import h5py as h5
+        from bundle import BundleWriter
 
+    nx, ny = args.reps
+    abcdef = get_abcdef(nx = nx, ny = ny, nlayer = args.layers)
+    name = 'ABCDEF'
+    if (nx, ny, args.layers) != (2, 2, 12):
+        name = 'ABCDEF_{}x{}x{}'.format(nx, ny, args.layers)
+    f = writer = None
+    if args.bundle is not None:
+        f = h5.File(args.bundle, 'w')
+        writer = BundleWriter(f, abcdef, nlayer = args.layers)
+    for name, system in [(name, abcdef)]:
+        for label, indices in iter_todo(2*nx*ny*args.layers):
+            print('{}_{} ({}): {}'.format(name, label, len(indices), indices))
+            arrays = convert_arrays(system, indices)
+            new_system = get_system(system, *arrays)
+            if writer is not None:
+                writer.add('{}_{}'.format(name, label), indices, *arrays)
+            folder = 'output'
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            new_system.to_file('output/{}_{}.chk'.format(name, label))
+            topology = get_topology(system, indices, nlayer = args.layers)
+            np.savez_compressed(get_fn_topology('output/{}_{}.chk'.format(name, label)), **topology)
+    if f is not None:
+        f.close()
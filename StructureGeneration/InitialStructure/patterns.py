@@ -0,0 +1,111 @@
+import time
+import argparse
+
+import numpy as np
+
+# Equivalent substitution patterns.
+#
+# A substitution pattern is the occupation vector of the SBU sites (1 = TFB).
+# SBU i is TP unit i of create_init.py, in cell i//2 of the supercell, where
+# the cells of layer l at lateral position (ix, iy) are numbered
+# l*nx*ny + ix*ny + iy (the order of System.supercell). Two patterns give the
+# same structure when they are related by
+#   - a lateral translation (ix, iy) -> (ix + dx, iy + dy), and
+#   - a translation by a multiple of six layers, the period of the ABCDEF
+#     stacking (only when the number of layers is a multiple of six, else the
+#     c vector is inclined and only the lateral translations remain).
+# The canonical key of a pattern is the smallest of the packed occupation
+# vectors of all its translations, so equivalent patterns have the same key
+# and a set of keys finds duplicates in O(1).
+
+def get_site_permutations(nx = 2, ny = 2, nlayer = 12):
+    # Array (nsym, nsite): site perm[j] of the pattern goes to site j
+    layers = np.arange(nlayer)
+    ix = np.arange(nx)
+    iy = np.arange(ny)
+    shifts = range(0, nlayer, 6) if nlayer % 6 == 0 else [0]
+    perms = []
+    for dl in shifts:
+        for dx in range(nx):
+            for dy in range(ny):
+                l, x, y = np.meshgrid((layers + dl) % nlayer, (ix + dx) % nx, (iy + dy) % ny, indexing = 'ij')
+                cells = (l*nx*ny + x*ny + y).ravel()
+                perms.append((2*cells.reshape(-1, 1) + np.arange(2)).ravel())
+    return np.array(perms)
+
+def get_keys(patterns, perms):
+    # Canonical keys (bytes) of the occupation vectors in the rows of patterns
+    patterns = np.atleast_2d(np.asarray(patterns, np.uint8))
+    packed = np.packbits(patterns[:, perms], axis = 2) # (npattern, nsym, nbyte)
+    # Lexicographic minimum over the symmetries, one byte at a time
+    candidates = np.ones(packed.shape[:2], bool)
+    for k in range(packed.shape[2]):
+        column = np.where(candidates, packed[:, :, k], 255)
+        candidates &= column == column.min(axis = 1).reshape(-1, 1)
+    best = candidates.argmax(axis = 1)
+    return [row.tobytes() for row in packed[np.arange(len(packed)), best]]
+
+def get_pattern(indices, nsite):
+    pattern = np.zeros(nsite, np.uint8)
+    pattern[np.asarray(indices, int)] = 1
+    return pattern
+
+class PatternIndex(object):
+    def __init__(self, nx = 2, ny = 2, nlayer = 12):
+        self.perms = get_site_permutations(nx, ny, nlayer)
+        self.nsite = self.perms.shape[1]
+        self.keys = set()
+
+    def get_key(self, indices):
+        return get_keys(get_pattern(indices, self.nsite), self.perms)[0]
+
+    def __contains__(self, indices):
+        return self.get_key(indices) in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, indices):
+        # Add the pattern with TFB units at indices, False if an equivalent
+        # pattern was added before
+        key = self.get_key(indices)
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+    def screen(self, patterns):
+        # Add the rows of patterns (occupation vectors), returns a mask of the
+        # new ones (also without duplicates among the rows)
+        new = np.zeros(len(patterns), bool)
+        for i, key in enumerate(get_keys(patterns, self.perms)):
+            if key not in self.keys:
+                self.keys.add(key)
+                new[i] = True
+        return new
+
+if __name__ == '__main__':
+    # Screen random patterns of one composition and count the distinct ones
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ntfb', type = int, default = 10)
+    parser.add_argument('--candidates', type = int, default = 1000000)
+    parser.add_argument('--batch', type = int, default = 10000)
+    parser.add_argument('--reps', nargs = 2, type = int, default = [2, 2])
+    parser.add_argument('--layers', type = int, default = 12)
+    parser.add_argument('--seed', type = int, default = 1912180624)
+    args = parser.parse_args()
+
+    index = PatternIndex(args.reps[0], args.reps[1], args.layers)
+    rng = np.random.RandomState(args.seed)
+    t0 = time.time()
+    ncandidate = 0
+    while ncandidate < args.candidates:
+        n = min(args.batch, args.candidates - ncandidate)
+        # Random patterns with ntfb sites occupied
+        order = np.argsort(rng.uniform(size = (n, index.nsite)), axis = 1)
+        patterns = (order < args.ntfb).astype(np.uint8)
+        index.screen(patterns)
+        ncandidate += n
+    elapsed = time.time() - t0
+    print('PATTERNS candidates = {} distinct = {} symmetries = {} t = {:.1f} s ({:.1f} us/candidate)'.format(
+        ncandidate, len(index), len(index.perms), elapsed, 1e6*elapsed/ncandidate))
@@ -0,0 +1,141 @@
+import time
+import argparse
+
+import numpy as np
+
+from molmod.units import angstrom
+
+from create_init import get_abcdef, get_linker_units, get_unit_atoms, natom_cell, tp_offsets, tfb_counts
+
+# Substitution patterns with a given short-range order.
+#
+# The Warren-Cowley parameter of a shell of neighbouring SBU pairs is
+#   alpha = 1 - N_unlike/(2 c (1 - c) N_pair),
+# with c the fraction of TFB units and N_unlike the number of TP-TFB pairs
+# among the N_pair pairs of the shell. It is 0 for a random pattern, negative
+# when TP and TFB alternate and positive when they cluster. Two shells are
+# used: the SBUs connected by a PA linker (in-plane) and the SBUs stacked on
+# top of each other in neighbouring layers (interlayer).
+#
+# SROSampler is a lattice Monte Carlo of swaps of a TP and a TFB unit (which
+# keeps the composition) with the cost sum_shell (alpha - target)^2, annealed
+# from temp0 to temp1. N_unlike of every shell is updated incrementally, so a
+# trial swap costs O(number of neighbours) instead of a recount.
+#
+# Run from the InitialStructure folder to sample one pattern, e.g.
+#   python sro.py --ntfb 48 --alpha 0.5 0.5
+
+def get_unit_centers(sys):
+    # Geometric center of every TP unit
+    tp_atoms = get_unit_atoms(2*(sys.natom//natom_cell), tp_offsets)
+    return sys.pos[tp_atoms].mean(axis = 1)
+
+def get_stacked_units(sys, min_dz = 1.0):
+    # Pairs (nunit, 2) of every TP unit with the nearest unit above it (at
+    # least min_dz angstrom higher, minimum image convention)
+    centers = get_unit_centers(sys)
+    rvecs = sys.cell.rvecs
+    gvecs = np.linalg.inv(rvecs)
+    delta = centers.reshape(1, -1, 3) - centers.reshape(-1, 1, 3)
+    frac = np.dot(delta, gvecs)
+    delta -= np.dot(np.round(frac), rvecs)
+    dist = np.linalg.norm(delta, axis = 2)
+    dist[delta[:, :, 2] < min_dz*angstrom] = np.inf
+    return np.array([np.arange(len(centers)), dist.argmin(axis = 1)]).T
+
+def get_shells(sys):
+    # In-plane and interlayer pairs of SBUs
+    return [get_linker_units(sys), get_stacked_units(sys)]
+
+class SROSampler(object):
+    def __init__(self, shells, occupation):
+        self.occupation = np.array(occupation, np.int8)
+        self.nsite = len(self.occupation)
+        self.npairs = np.array([len(pairs) for pairs in shells], float)
+        # Neighbours of every site per shell (CSR), counted once per pair
+        self.neighbours = []
+        for pairs in shells:
+            sites = np.concatenate([pairs[:, 0], pairs[:, 1]])
+            others = np.concatenate([pairs[:, 1], pairs[:, 0]])
+            order = np.argsort(sites, kind = 'stable')
+            indptr = np.concatenate([[0], np.cumsum(np.bincount(sites, minlength = self.nsite))])
+            self.neighbours.append((indptr, others[order]))
+        self.nunlike = np.array([np.sum(self.occupation[pairs[:, 0]] != self.occupation[pairs[:, 1]])
+                for pairs in shells], float)
+        c = self.occupation.mean()
+        self.norm = 2*c*(1 - c)*self.npairs
+
+    def get_alpha(self, nunlike = None):
+        if nunlike is None:
+            nunlike = self.nunlike
+        if (self.norm == 0).any():
+            return np.zeros(len(self.npairs))
+        return 1 - nunlike/self.norm
+
+    def get_delta(self, i, j):
+        # Change of N_unlike per shell when the units at i and j are swapped
+        delta = np.zeros(len(self.neighbours))
+        for s, (indptr, others) in enumerate(self.neighbours):
+            for site, other in [(i, j), (j, i)]:
+                neighs = others[indptr[site]:indptr[site + 1]]
+                neighs = neighs[neighs != other] # The pair i-j stays unlike
+                same = np.sum(self.occupation[neighs] == self.occupation[site])
+                delta[s] += 2*same - len(neighs)
+        return delta
+
+    def run(self, target, nstep = 100000, temp0 = 1e-2, temp1 = 1e-5, tol = 0.01, rng = None):
+        # Anneal towards the target alpha of every shell, stop when all of them
+        # are within tol. Returns the number of steps done.
+        if rng is None:
+            rng = np.random
+        target = np.array(target, float)
+        cost = np.sum((self.get_alpha() - target)**2)
+        ones = np.where(self.occupation == 1)[0]
+        zeros = np.where(self.occupation == 0)[0]
+        if len(ones) == 0 or len(zeros) == 0:
+            return 0
+        for step in range(nstep):
+            if np.all(np.abs(self.get_alpha() - target) < tol):
+                return step
+            temp = temp0*(temp1/temp0)**(step/float(nstep))
+            a, b = rng.randint(len(ones)), rng.randint(len(zeros))
+            i, j = ones[a], zeros[b]
+            nunlike = self.nunlike + self.get_delta(i, j)
+            new_cost = np.sum((self.get_alpha(nunlike) - target)**2)
+            if new_cost <= cost or rng.uniform() < np.exp(-(new_cost - cost)/temp):
+                self.occupation[i], self.occupation[j] = 0, 1
+                ones[a], zeros[b] = j, i
+                self.nunlike = nunlike
+                cost = new_cost
+        return nstep
+
+def sample_pattern(shells, ntp, ntfb, target, rng, tol = 0.01, **kwargs):
+    # TFB unit indices with the target alpha, starting from a random pattern,
+    # the reached alpha and whether it is within tol of the target
+    occupation = np.zeros(ntp, np.int8)
+    occupation[rng.choice(ntp, size = ntfb, replace = False)] = 1
+    sampler = SROSampler(shells, occupation)
+    sampler.run(target, rng = rng, tol = tol, **kwargs)
+    alpha = sampler.get_alpha()
+    return np.where(sampler.occupation == 1)[0], alpha, bool(np.all(np.abs(alpha - target) < tol))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ntfb', type = int, default = tfb_counts[4])
+    parser.add_argument('--alpha', nargs = 2, type = float, default = [0.0, 0.0],
+            help = 'target Warren-Cowley parameters (in-plane, interlayer)')
+    parser.add_argument('--steps', type = int, default = 100000)
+    parser.add_argument('--reps', nargs = 2, type = int, default = [2, 2])
+    parser.add_argument('--layers', type = int, default = 12)
+    parser.add_argument('--seed', type = int, default = 1912180624)
+    args = parser.parse_args()
+
+    sys = get_abcdef(nx = args.reps[0], ny = args.reps[1], nlayer = args.layers)
+    shells = get_shells(sys)
+    ntp = 2*(sys.natom//natom_cell)
+    t0 = time.time()
+    indices, alpha, converged = sample_pattern(shells, ntp, args.ntfb, args.alpha, np.random.RandomState(args.seed),
+            nstep = args.steps)
+    if not converged:
+        print('WARNING target alpha not reached in {} steps'.format(args.steps))
+    print('SRO alpha = {:.3f} {:.3f} t = {:.2f} s: {}'.format(alpha[0], alpha[1], time.time() - t0, sorted(indices)))
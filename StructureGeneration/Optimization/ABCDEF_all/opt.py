@@ -1,21 +1,48 @@
+import os
+import argparse
+
 from yaff import System
 from yaff.pes.ff import ForceField
 from yaff.sampling.dof import CartesianDOF, StrainCellDOF
-from yaff.sampling.opt import CGOptimizer
 
 from molmod.units import angstrom
 
+from opttools.checkpoint import write_state, read_system_state, read_optimizer, read_state, prune_saves
+from opttools.optimizers import get_optimizer, optimizers
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--resume', action = 'store_true',
+        help = 'continue the optimization from ABCDEF_all_state.h5')
+parser.add_argument('--segment', type = int, default = 10000,
+        help = 'number of steps between two checkpoints')
+parser.add_argument('--optimizer', choices = optimizers, default = None,
+        help = 'optimizer (see opttools/optimizers.py), default cg or the one of the checkpoint when resuming')
+args = parser.parse_args()
+
+fn_state = 'ABCDEF_all_state.h5'
+if args.optimizer is None:
+    args.optimizer = read_optimizer(fn_state) if args.resume else 'cg'
 sys = System.from_file('ABCDEF_all.chk')
+counter = 0
+if args.resume:
+    counter = read_system_state(fn_state, sys)
 ff = ForceField.generate(sys, 'pars.txt', rcut = 15.0*angstrom,
         alpha_scale = 2.86, gcut_scale = 1.0, smooth_ei = True, tailcorrections = True)
 dof = StrainCellDOF(ff)
-opt = CGOptimizer(dof)
+opt = get_optimizer(args.optimizer, dof, 'pars.txt', counter0 = counter)
+if args.resume:
+    read_state(fn_state, opt, args.optimizer)
 while True:
-    opt.run(10000)
+    start = opt.counter
+    opt.run(args.segment)
     opt.dof.ff.system.to_file('ABCDEF_all_save{}.chk'.format(opt.counter))
+    write_state(fn_state, opt, args.optimizer)
+    prune_saves('ABCDEF_all', keep = opt.counter)
     if opt.dof.converged:
         opt.dof.ff.system.to_file('ABCDEF_all_opt.chk')
+        prune_saves('ABCDEF_all')
+        os.remove(fn_state)
         break
-    if not opt.counter % 10000 == 0:
+    if opt.counter - start < args.segment:
+        # Line search failed, the last checkpoint allows to inspect or resume it
         break
-
@@ -14,8 +14,17 @@ cd $ORIGDIR
 # Load modules
 module load LAMMPS/3Mar2020-foss-2019b-Python-3.7.4-kokkos # Load LAMMPS, also loads yaff
 
-# Run
-python opt.py > opt.log
+# Shared helpers of StructureGeneration/Optimization/opttools
+export PYTHONPATH=${ORIGDIR}/..:$PYTHONPATH
+
+# Run, or continue from the checkpoint of an interrupted job (resubmit opt.sh)
+# with the optimizer stored in the checkpoint
+if [ -f ABCDEF_full38_state.h5 ]; then
+    OPTIMIZER=$(python -m opttools.checkpoint ABCDEF_full38_state.h5)
+    python opt.py --resume --optimizer $OPTIMIZER >> opt.log
+else
+    python opt.py > opt.log
+fi
 
 date
 
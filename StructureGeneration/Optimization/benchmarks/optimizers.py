@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import argparse
+
+from yaff import System, log
+from yaff.pes.ff import ForceField
+from yaff.sampling.dof import StrainCellDOF
+
+from molmod.units import angstrom, kjmol
+
+from opttools.optimizers import get_optimizer, optimizers
+
+# Count the energy and gradient calls of every optimizer of opttools until
+# the StrainCellDOF of opt.py has converged, for every ABCDEF_* structure.
+# All optimizers start from the initial structure <struct>/<struct>.chk with
+# the force field of opt.py. The calls are counted on the DOF, so the extra
+# gradients of CovalentPrecon and the line searches are included. A run that
+# stops (line search failure) or reaches --steps is reported as not
+# converged.
+#
+# Fewer calls only help if the optimizer ends in the same minimum. The layers
+# can slide with little resistance, so an optimizer may converge to another,
+# higher local minimum than CG. The final energy is therefore also reported
+# relative to the one of CG (depot, the first optimizer by default), and runs
+# that end more than --etol above it are marked in the summary.
+#
+# Run from the Optimization folder, e.g.
+#   PYTHONPATH=. python benchmarks/optimizers.py --structs ABCDEF_all ABCDEF_none
+# or submit qsub benchmarks/optimizers.sh for all structures. The two-layer
+# systems of the static scan are a cheaper test case, e.g.
+#   PYTHONPATH=. python benchmarks/optimizers.py --chk ../../StaticScan/data/{struct}/nonopt_2layers.chk \
+#       --rcut 10 --steps 3000
+
+structs = ['ABCDEF_all', 'ABCDEF_full10', 'ABCDEF_full19', 'ABCDEF_full29', 'ABCDEF_full38', 'ABCDEF_full48',
+        'ABCDEF_full58', 'ABCDEF_full67', 'ABCDEF_full77', 'ABCDEF_full86', 'ABCDEF_none']
+
+def count_calls(dof):
+    # Wrap dof.fun to count the calls without (energy) and with gradient
+    counts = {'energy': 0, 'gradient': 0}
+    fun = dof.fun
+    def counted(x, do_gradient = False):
+        counts['gradient' if do_gradient else 'energy'] += 1
+        return fun(x, do_gradient)
+    dof.fun = counted
+    return counts
+
+# Force field of opt.py
+ff_kwargs = {
+        'rcut': 15.0*angstrom,
+        'alpha_scale': 2.86,
+        'gcut_scale': 1.0,
+        'smooth_ei': True,
+        'tailcorrections': True
+}
+
+def run(struct, name, nstep, fn_chk = '{struct}/{struct}.chk'):
+    system = System.from_file(fn_chk.format(struct = struct))
+    fn_pars = os.path.join(struct, 'pars.txt')
+    ff = ForceField.generate(system, fn_pars, **ff_kwargs)
+    dof = StrainCellDOF(ff)
+    counts = count_calls(dof)
+    t0 = time.time()
+    opt = get_optimizer(name, dof, fn_pars)
+    opt.run(nstep)
+    return opt.counter, counts, opt.epot, dof.converged, time.time() - t0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--structs', nargs = '+', default = structs)
+    parser.add_argument('--optimizers', nargs = '+', choices = optimizers, default = optimizers)
+    parser.add_argument('--steps', type = int, default = 100000,
+            help = 'maximum number of steps of every optimization')
+    parser.add_argument('--chk', default = '{struct}/{struct}.chk',
+            help = 'initial structure of every optimization, {struct} is replaced by the structure')
+    parser.add_argument('--rcut', type = float, default = 15.0,
+            help = 'cutoff of the force field in angstrom')
+    parser.add_argument('--etol', type = float, default = 1.0,
+            help = 'final energies more than this (kJ/mol) above the one of cg are marked')
+    parser.add_argument('--out', default = 'benchmarks/optimizers.dat')
+    args = parser.parse_args()
+
+    ff_kwargs['rcut'] = args.rcut*angstrom
+    log.set_level(log.silent)
+    summary = []
+    with open(args.out, 'w') as f:
+        f.write('# python ' + ' '.join(sys.argv) + '\n')
+        f.write('# struct optimizer steps energy_calls gradient_calls epot[kJ/mol] depot[kJ/mol] converged time[s]\n')
+        for struct in args.structs:
+            results = {}
+            for name in args.optimizers:
+                nstep, counts, epot, converged, elapsed = run(struct, name, args.steps, fn_chk = args.chk)
+                results[name] = (counts['energy'] + counts['gradient'], epot, converged)
+                depot = (epot - results['cg'][1])/kjmol if 'cg' in results else float('nan')
+                line = '{} {} {} {} {} {:.4f} {:.4f} {} {:.1f}'.format(struct, name, nstep, counts['energy'],
+                        counts['gradient'], epot/kjmol, depot, int(converged), elapsed)
+                print(line)
+                f.write(line + '\n')
+                f.flush()
+            if 'cg' not in results:
+                continue
+            ncall_cg, epot_cg, converged_cg = results['cg']
+            for name, (ncall, epot, converged) in results.items():
+                if name == 'cg':
+                    continue
+                depot = (epot - epot_cg)/kjmol
+                flags = ([] if converged else ['not converged']) + (['higher energy'] if depot > args.etol else [])
+                summary.append('{} {}: {} calls (cg {}{}), epot {:+.1f} kJ/mol w.r.t. cg{}'.format(
+                        struct, name, ncall, ncall_cg, '' if converged_cg else ', not converged', depot,
+                        ' ({})'.format(', '.join(flags)) if flags else ''))
+    print('\n'.join(summary))
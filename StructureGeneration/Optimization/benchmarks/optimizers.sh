@@ -0,0 +1,19 @@
+#!/bin/sh
+#
+#PBS -N _opt_optimizers
+#PBS -l walltime=72:00:00
+#PBS -l nodes=1:ppn=1
+#PBS -m n
+
+date
+
+# Run from the Optimization folder
+cd $PBS_O_WORKDIR
+
+# Load modules
+module load LAMMPS/3Mar2020-foss-2019b-Python-3.7.4-kokkos # Load LAMMPS, also loads yaff
+
+# Run
+PYTHONPATH=. python benchmarks/optimizers.py > benchmarks/optimizers.log
+
+date
@@ -0,0 +1 @@
+# Shared helpers for the opt.py scripts in StructureGeneration/Optimization/<struct>/
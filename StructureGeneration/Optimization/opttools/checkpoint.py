@@ -0,0 +1,113 @@
+import os
+import re
+import sys
+
+import numpy as np
+import h5py as h5
+
+# Checkpoint of a Yaff optimization, to continue it exactly in a new job.
+#
+# The optimizer (counter, epot, x), the degrees of freedom (e.g. the reference
+# cell and the convergence history of StrainCellDOF) and, for CGOptimizer, the
+# molmod Minimizer with its search direction (the conjugate direction and the
+# previous gradient) and line search, or the history and preconditioner of the
+# optimizers in opttools.optimizers, all keep their state in plain attributes.
+# Every attribute that is an array, a number, a string or None is written to
+# a group of the checkpoint, together with the positions and cell of the
+# system. After a new optimizer is set up for the same system, read_state
+# restores these attributes, so the next step is the one the interrupted run
+# would have taken.
+#
+# The name of the optimizer (--optimizer of opt.py) is stored as well: e.g.
+# lbfgs and lbfgs-covalent are the same class with another preconditioner,
+# so the class alone does not tell them apart. It can be printed with
+#   python -m opttools.checkpoint <struct>_state.h5
+#
+# The checkpoint is written to a temporary file first and then renamed, so a
+# job killed during a write leaves the previous checkpoint intact.
+
+def get_state_objects(opt):
+    # Objects of opt that hold state, by name
+    objects = {'optimizer': opt, 'dof': opt.dof}
+    if getattr(opt, 'precon', None) is not None:
+        objects['precon'] = opt.precon
+    minimizer = getattr(opt, 'minimizer', None)
+    if minimizer is not None:
+        objects['minimizer'] = minimizer
+        for key in ['search_direction', 'line_search']:
+            if getattr(minimizer, key, None) is not None:
+                objects[key] = getattr(minimizer, key)
+    return objects
+
+def get_attributes(obj):
+    # Attributes of obj that are arrays, numbers, strings or None
+    return dict((key, value) for key, value in vars(obj).items()
+            if value is None or isinstance(value, (np.ndarray, np.number, bool, int, float, str)))
+
+def write_state(fn, opt, name):
+    # name is the name of the optimizer in opttools.optimizers.optimizers
+    system = opt.dof.ff.system
+    with h5.File(fn + '.tmp', 'w') as f:
+        f.attrs['counter'] = opt.counter
+        f.attrs['optimizer'] = name
+        f['system/pos'] = system.pos
+        f['system/rvecs'] = system.cell.rvecs
+        for name, obj in get_state_objects(opt).items():
+            grp = f.create_group('state/{}'.format(name))
+            none = []
+            for key, value in get_attributes(obj).items():
+                if value is None:
+                    none.append(key)
+                elif isinstance(value, str):
+                    grp.attrs[key] = value
+                else:
+                    grp[key] = value
+            grp.attrs['_none'] = np.array(none, 'S')
+    os.rename(fn + '.tmp', fn)
+
+def read_system_state(fn, system):
+    # Set the positions and cell of system to the ones of the checkpoint, before
+    # the force field is generated. Returns the counter.
+    with h5.File(fn, 'r') as f:
+        system.pos[:] = f['system/pos'][:]
+        system.cell.update_rvecs(f['system/rvecs'][:])
+        return int(f.attrs['counter'])
+
+def read_optimizer(fn):
+    # Name of the optimizer of the checkpoint
+    with h5.File(fn, 'r') as f:
+        return str(f.attrs['optimizer'])
+
+def read_state(fn, opt, name):
+    # Restore the attributes of a new optimizer (called name) for the system
+    # of the checkpoint
+    if read_optimizer(fn) != name:
+        raise ValueError('Checkpoint {} is of optimizer {}, not of {}'.format(
+            fn, read_optimizer(fn), name))
+    with h5.File(fn, 'r') as f:
+        objects = get_state_objects(opt)
+        for name, grp in f['state'].items():
+            if name not in objects:
+                raise ValueError('Checkpoint {} has state of {}, which {} does not have'.format(
+                    fn, name, opt.__class__.__name__))
+            obj = objects[name]
+            for key, ds in grp.items():
+                setattr(obj, key, ds[()])
+            for key, value in grp.attrs.items():
+                if key == '_none':
+                    for none in value:
+                        setattr(obj, none.decode(), None)
+                else:
+                    setattr(obj, key, value)
+
+def prune_saves(name, keep = None, folder = '.'):
+    # Remove the intermediate <name>_save<counter>.chk files, except the one of
+    # counter keep
+    pattern = re.compile(r'{}_save(\d+)\.chk$'.format(re.escape(name)))
+    for fn in sorted(os.listdir(folder)):
+        match = pattern.match(fn)
+        if match is not None and int(match.group(1)) != keep:
+            os.remove(os.path.join(folder, fn))
+
+if __name__ == '__main__':
+    print(read_optimizer(sys.argv[1]))
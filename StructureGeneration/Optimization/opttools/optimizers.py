@@ -0,0 +1,279 @@
+import numpy as np
+
+from scipy.sparse import coo_matrix, identity
+from scipy.sparse.linalg import factorized
+
+from yaff import log
+from yaff.sampling.dof import BaseCellDOF
+from yaff.sampling.opt import BaseOptimizer, CGOptimizer
+
+from molmod.units import angstrom, parse_unit
+
+# L-BFGS and FIRE optimizers for the cell DOFs of Yaff (e.g. StrainCellDOF).
+#
+# The degrees of freedom x of a BaseCellDOF are the cell variables (for
+# StrainCellDOF the six components of the deformation A of the initial cell,
+# rvecs = A.rvecs0) followed by the fractional coordinates, pos = frac.rvecs.
+# Both are dimensionless, and the gradient towards them is an energy.
+#
+# A preconditioner P approximates the Hessian towards x and the optimizers
+# move along -P^-1 g instead of -g:
+#   - CartesianPrecon has a stiffness of 1 au per Cartesian coordinate of the
+#     atoms and the cell vectors, i.e. steepest descent in Cartesian
+#     coordinates. Towards the fractional coordinates, this is
+#     I (x) rvecs.rvecs^T.
+#   - CovalentPrecon replaces the identity by the covalent Hessian, the
+#     Laplacian of the bond graph weighted with the BONDHARM force constants
+#     of pars.txt (isotropic, every bond a spring of constant K in all
+#     directions), L (x) rvecs.rvecs^T. The layers are only held together by
+#     non-covalent interactions, so mu times the mean force constant is added
+#     to the diagonal and sets the stiffness of their relative translations.
+#     Towards every cell variable, the stiffness follows from a finite
+#     difference of the gradient (ncelldof + 1 extra gradient calls), as a
+#     deformation along the stacking direction stretches no bonds.
+# L is factorized once, so P^-1 g costs about as much as a sparse
+# matrix-vector product.
+#
+# LBFGSOptimizer keeps the last nmemory steps and gradient changes and uses
+# the two-loop recursion with gamma P^-1 as initial inverse Hessian, with a
+# backtracking (Armijo) line search. FIREOptimizer is the fast inertial
+# relaxation engine (Bitzek et al., PRL 97, 170201 (2006)) with -P^-1 g as
+# force. Both limit the largest displacement of an atom or cell vector per
+# step to maxstep, and keep their state (history, velocities, time step) in
+# array attributes, so opttools.checkpoint can continue them exactly.
+#
+# get_optimizer only combines CovalentPrecon with L-BFGS: FIRE scales its
+# velocities with the norm of the preconditioned force, which is not a
+# meaningful length for CovalentPrecon, and FIRE with it did not converge in
+# 3000 steps on the two-layer ABCDEF_all where plain FIRE needed 1311. On the
+# sliding layers, L-BFGS and FIRE can also converge to another local minimum
+# than CG (about 18 kJ/mol higher for the two-layer ABCDEF_all), so CG stays
+# the default, see benchmarks/optimizers.py.
+
+def get_bond_constants(fn_pars):
+    # Force constants of the BONDHARM terms in fn_pars, by pair of ffatypes
+    unit = None
+    constants = {}
+    with open(fn_pars) as f:
+        for line in f:
+            words = line.split('#')[0].split()
+            if len(words) == 3 and words[0] == 'BONDHARM:UNIT' and words[1] == 'K':
+                unit = parse_unit(words[2])
+            elif len(words) >= 5 and words[0] == 'BONDHARM:PARS':
+                constants[(words[1], words[2])] = constants[(words[2], words[1])] = float(words[3])*unit
+    return constants
+
+def get_rvecs(dof, x):
+    # Cell vectors for the cell variables of x
+    return dof._cellvars_to_rvecs(dof._expand_celldofs(x[:dof.ncelldof]))
+
+def get_max_displacement(dof, x, dx):
+    # Largest Cartesian displacement of an atom or cell vector for the step dx
+    rvecs = get_rvecs(dof, x)
+    drvecs = get_rvecs(dof, x + dx) - rvecs
+    dpos = np.dot(dx[dof.ncelldof:].reshape(-1, 3), rvecs)
+    return max(np.linalg.norm(drvecs, axis = 1).max(), np.linalg.norm(dpos, axis = 1).max())
+
+class CartesianPrecon(object):
+    def __init__(self, dof):
+        if not isinstance(dof, BaseCellDOF) or dof.do_frozen:
+            raise TypeError('The preconditioners require a cell DOF with fractional coordinates')
+        self.dof = dof
+        self.ncelldof = dof.ncelldof
+        self.cell_stiffness = np.array([(drvecs**2).sum() for drvecs in self.get_cell_derivatives()])
+
+    def get_cell_derivatives(self):
+        # Derivatives of the cell vectors towards every cell variable
+        x0 = self.dof.x0
+        rvecs0 = get_rvecs(self.dof, x0)
+        return [get_rvecs(self.dof, x0 + np.identity(len(x0))[k]) - rvecs0 for k in range(self.ncelldof)]
+
+    def solve(self, gpos):
+        # Solution of the Cartesian part of P for every column of gpos
+        return gpos
+
+    def apply(self, x, gx):
+        # P^-1 gx at x
+        n = self.ncelldof
+        rvecs = get_rvecs(self.dof, x)
+        result = np.zeros(len(gx))
+        result[:n] = gx[:n]/self.cell_stiffness
+        metric = np.dot(rvecs, rvecs.T)
+        result[n:] = np.dot(self.solve(gx[n:].reshape(-1, 3)), np.linalg.inv(metric)).ravel()
+        return result
+
+class CovalentPrecon(CartesianPrecon):
+    def __init__(self, dof, fn_pars, mu = 0.01, h = 1e-3):
+        CartesianPrecon.__init__(self, dof)
+        system = dof.ff.system
+        constants = get_bond_constants(fn_pars)
+        ffatypes = np.array(system.ffatypes)[system.ffatype_ids]
+        bonds = system.bonds
+        k = np.array([constants.get((ffatypes[i], ffatypes[j]), np.nan) for i, j in bonds])
+        if np.isnan(k).all():
+            raise ValueError('No BONDHARM force constants for the bonds in {}'.format(fn_pars))
+        k[np.isnan(k)] = np.nanmean(k)
+        self.mu = mu
+        # Weighted Laplacian of the bond graph
+        rows = np.concatenate([bonds[:, 0], bonds[:, 1], bonds[:, 0], bonds[:, 1]])
+        cols = np.concatenate([bonds[:, 0], bonds[:, 1], bonds[:, 1], bonds[:, 0]])
+        values = np.concatenate([k, k, -k, -k])
+        laplacian = coo_matrix((values, (rows, cols)), shape = (system.natom, system.natom)).tocsc()
+        laplacian = laplacian + mu*k.mean()*identity(system.natom, format = 'csc')
+        self.solver = factorized(laplacian)
+        # Curvature towards every cell variable from finite differences of the
+        # gradient (the stacking of the layers involves no bonds), or else
+        # from the deformation of all bonds (minimum image convention)
+        rvecs = system.cell.rvecs
+        dfrac = np.dot(system.pos[bonds[:, 1]] - system.pos[bonds[:, 0]], np.linalg.inv(rvecs))
+        dfrac -= np.round(dfrac)
+        covalent = np.array([np.sum(k*(np.dot(dfrac, drvecs)**2).sum(axis = 1))
+                for drvecs in self.get_cell_derivatives()])
+        x0 = dof.x0
+        g0 = dof.fun(x0, True)[1]
+        stiffness = np.zeros(self.ncelldof)
+        for i in range(self.ncelldof):
+            x = x0.copy()
+            x[i] += h
+            stiffness[i] = (dof.fun(x, True)[1][i] - g0[i])/h
+        dof.reset()
+        self.cell_stiffness = np.where(stiffness > 0, stiffness, np.maximum(covalent, mu*covalent.mean()))
+
+    def solve(self, gpos):
+        return np.array([self.solver(column) for column in gpos.T]).T
+
+class LBFGSOptimizer(BaseOptimizer):
+    log_name = 'LBFGS'
+
+    def __init__(self, dof, state = None, hooks = None, counter0 = 0, precon = None, nmemory = 10,
+            maxstep = 0.2*angstrom, armijo = 1e-4, nbacktrack = 10):
+        self.precon = CartesianPrecon(dof) if precon is None else precon
+        self.nmemory = nmemory
+        self.maxstep = maxstep
+        self.armijo = armijo
+        self.nbacktrack = nbacktrack
+        BaseOptimizer.__init__(self, dof, state, hooks, counter0)
+
+    def initialize(self):
+        self.x = self.dof.x0.copy()
+        self.f, self.g = self.fun(self.x, True)
+        # Steps and gradient changes, oldest first
+        self.steps = np.zeros((self.nmemory, len(self.x)))
+        self.changes = np.zeros((self.nmemory, len(self.x)))
+        self.nhistory = 0
+        BaseOptimizer.initialize(self)
+
+    def get_direction(self):
+        # Two-loop recursion, with gamma P^-1 as initial inverse Hessian
+        n = self.nhistory
+        steps, changes = self.steps[:n], self.changes[:n]
+        rhos = 1.0/np.einsum('ij,ij->i', steps, changes)
+        alphas = np.zeros(n)
+        q = self.g.copy()
+        for i in range(n - 1, -1, -1):
+            alphas[i] = rhos[i]*np.dot(steps[i], q)
+            q -= alphas[i]*changes[i]
+        r = self.precon.apply(self.x, q)
+        if n > 0:
+            r *= np.dot(steps[-1], changes[-1])/np.dot(changes[-1], self.precon.apply(self.x, changes[-1]))
+        for i in range(n):
+            beta = rhos[i]*np.dot(changes[i], r)
+            r += (alphas[i] - beta)*steps[i]
+        return -r
+
+    def propagate(self):
+        direction = self.get_direction()
+        if np.dot(direction, self.g) >= 0:
+            # No descent direction, forget the history
+            self.nhistory = 0
+            direction = self.get_direction()
+        step = min(1.0, self.maxstep/get_max_displacement(self.dof, self.x, direction))
+        slope = np.dot(direction, self.g)
+        for i in range(self.nbacktrack):
+            x = self.x + step*direction
+            f, g = self.fun(x, True)
+            if f <= self.f + self.armijo*step*slope:
+                break
+            step *= 0.5
+        else:
+            # Back at the last point, for the convergence check of the DOF
+            self.fun(self.x, True)
+            if log.do_warning:
+                log.warn('Line search failed in optimizer. Aborting optimization.')
+            return True
+        s, y = x - self.x, g - self.g
+        if np.dot(s, y) > 0:
+            if self.nhistory == self.nmemory:
+                self.steps[:-1] = self.steps[1:]
+                self.changes[:-1] = self.changes[1:]
+                self.nhistory -= 1
+            self.steps[self.nhistory] = s
+            self.changes[self.nhistory] = y
+            self.nhistory += 1
+        self.x, self.f, self.g = x, f, g
+        return BaseOptimizer.propagate(self)
+
+class FIREOptimizer(BaseOptimizer):
+    log_name = 'FIRE'
+
+    def __init__(self, dof, state = None, hooks = None, counter0 = 0, precon = None, dt = 0.1, dtmax = 1.0,
+            maxstep = 0.2*angstrom, nmin = 5, finc = 1.1, fdec = 0.5, alpha0 = 0.1, falpha = 0.99):
+        self.precon = CartesianPrecon(dof) if precon is None else precon
+        self.dt0 = dt
+        self.dtmax = dtmax
+        self.maxstep = maxstep
+        self.nmin = nmin
+        self.finc = finc
+        self.fdec = fdec
+        self.alpha0 = alpha0
+        self.falpha = falpha
+        BaseOptimizer.__init__(self, dof, state, hooks, counter0)
+
+    def initialize(self):
+        self.x = self.dof.x0.copy()
+        self.f, self.g = self.fun(self.x, True)
+        self.vel = np.zeros(len(self.x))
+        self.dt = self.dt0
+        self.alpha = self.alpha0
+        self.npositive = 0
+        BaseOptimizer.initialize(self)
+
+    def propagate(self):
+        force = -self.precon.apply(self.x, self.g)
+        power = np.dot(force, self.vel)
+        if power > 0:
+            # Mix the velocity towards the force, speed up after nmin steps
+            self.vel = (1 - self.alpha)*self.vel + self.alpha*force*np.linalg.norm(self.vel)/np.linalg.norm(force)
+            if self.npositive > self.nmin:
+                self.dt = min(self.dt*self.finc, self.dtmax)
+                self.alpha *= self.falpha
+            self.npositive += 1
+        elif power < 0:
+            # Uphill, stop and restart with a smaller time step
+            self.vel[:] = 0.0
+            self.alpha = self.alpha0
+            self.dt *= self.fdec
+            self.npositive = 0
+        self.vel += self.dt*force
+        dx = self.dt*self.vel
+        displacement = get_max_displacement(self.dof, self.x, dx)
+        if displacement > self.maxstep:
+            dx *= self.maxstep/displacement
+        self.x = self.x + dx
+        self.f, self.g = self.fun(self.x, True)
+        return BaseOptimizer.propagate(self)
+
+optimizers = ['cg', 'lbfgs', 'lbfgs-covalent', 'fire']
+
+def get_optimizer(name, dof, fn_pars = 'pars.txt', **kwargs):
+    # Optimizer of the name in optimizers, lbfgs-covalent preconditions with
+    # the BONDHARM force constants of fn_pars
+    if name == 'cg':
+        return CGOptimizer(dof, **kwargs)
+    elif name == 'lbfgs':
+        return LBFGSOptimizer(dof, **kwargs)
+    elif name == 'lbfgs-covalent':
+        return LBFGSOptimizer(dof, precon = CovalentPrecon(dof, fn_pars), **kwargs)
+    elif name == 'fire':
+        return FIREOptimizer(dof, **kwargs)
+    raise ValueError('Unknown optimizer {}, choose from {}'.format(name, ', '.join(optimizers)))